@@ -1,13 +1,66 @@
 """ An API for displaying news stories. """
 
-from datetime import datetime
-from flask import Flask, current_app, request
-from news_scraper import get_html, parse_stories_bs
-from storage import load_from_file, save_to_file
-from requests import HTTPError
+from datetime import datetime, timezone
+from functools import partial
+from urllib.parse import urlsplit
+from flask import Flask, Response, current_app, make_response, request
+from flask.json.provider import DefaultJSONProvider
+from json_codec import decode, encode
+from news_scraper import get_html_pages, parse_stories_bs, stream_pages_stories
+from storage import (SORT_PARAMS, TIME_FORMAT, TOMBSTONE_MAX_AGE, ScoreBelowZero, StoryStore,
+                     format_timestamp, get_store, normalize_url, parse_timestamp, timestamp_now)
+from response_cache import get_response_cache
+from scrape_jobs import ScrapeError, ScrapeQueueFull, get_scrape_queue, get_scrape_scheduler
+from story_events import StoryEvents
 
 
-app = Flask(__name__)
+MAX_PAGE_SIZE = 100
+MAX_OFFSET = 2 ** 31 - 1
+MAX_BATCH_SIZE = 5000
+MAX_SCRAPE_URLS = 20
+STATIC_MAX_AGE = 24 * 60 * 60
+CHANGES_OVERLAP = 5
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """ Encodes responses and decodes request bodies with the same codec as the stores,
+        orjson when it is installed, which is many times faster than the json module
+        for long listings. Responses hold the same JSON as with Flask's own provider. """
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return encode(obj, sort_keys=self.sort_keys, default=self.default).decode()
+
+    def loads(self, s: str | bytes, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return decode(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(
+            encode(obj, pretty, self.sort_keys, self.default) + b"\n", mimetype=self.mimetype)
+
+
+class NewsApp(Flask):
+    """ A Flask app that lets browsers keep scripts and styles for STATIC_MAX_AGE seconds,
+        while pages are checked for changes every time they are loaded. """
+
+    json_provider_class = FastJSONProvider
+
+    def get_send_file_max_age(self, filename: str | None) -> int | None:
+        if filename and filename.endswith(".html"):
+            return None
+        return STATIC_MAX_AGE
+
+
+app = NewsApp(__name__)
+store = get_store()
+response_cache = get_response_cache()
+scrape_queue = get_scrape_queue()
+story_events = StoryEvents()
 
 
 class HelpApp():
@@ -25,70 +78,133 @@ class HelpApp():
             story['score'] += 1
         else:
             story['score'] -= 1
-        story['updated_at'] = datetime.now().strftime(
-            "%a, %d %b %Y %H:%M:%S GMT")
-
-    @staticmethod
-    def search_stories(stories_list: list[dict], search_term: str) -> list[dict]:
-        """ Searches for stories that have the search term in their title. """
-        queried_stories = [story for story in stories_list
-                        if search_term.lower() in story['title'].lower()]
-        return queried_stories
-
-    @staticmethod
-    def sort_stories(stories_list: list[dict],
-                     sort_param: str, order_param: str = None) -> list[dict]:
-        """ Sorts stories depending on given sort property and order. 
-            Defaults to ascending order. """
-        reverse_order = False
-        if order_param == 'descending':
-            reverse_order = True
-        if sort_param == 'title':
-            return sorted(stories_list, key=lambda val: val['title'].upper(), reverse=reverse_order)
-        if sort_param == 'score':
-            return sorted(
-                stories_list, key=lambda val: val['score'], reverse=reverse_order)
-        if sort_param == 'created':
-            return sorted(stories_list,
-                        key=lambda val: datetime.strptime(val['created_at'],
-                                                            "%a, %d %b %Y %H:%M:%S GMT"),
-                        reverse=reverse_order)
-        if sort_param == 'modified':
-            return sorted(stories_list,
-                        key=lambda val: datetime.strptime(val['updated_at'],
-                                                        "%a, %d %b %Y %H:%M:%S GMT"),
-                        reverse=reverse_order)
+        story['updated_at'] = datetime.now().strftime(TIME_FORMAT)
+
+    @staticmethod
+    def check_vote(story: dict | None, direction: str) -> tuple | None:
+        """ Returns the error for a vote that can't be made on the story, or None. """
+        if not story:
+            return HelpApp.error_return("ID not found"), 404
+        if story['score'] == 0 and direction == 'down':
+            return HelpApp.error_return("Can't downvote for a story with 0 votes"), 400
         return None
 
     @staticmethod
-    def search_sort(stories: list[dict], search: str, sort: str, order: str) -> tuple:
-        """ Returns a tuple based on the values of search and sort. """
-        if search and sort:
-            found_stories = HelpApp.search_stories(stories, search)
-            if len(found_stories) == 0:
-                return found_stories, 404
-            return HelpApp.sort_stories(found_stories, sort, order), 200
-        if sort:
-            return HelpApp.sort_stories(stories, sort, order), 200
+    def valid_url(url) -> bool:
+        """ Returns whether the url is an http or https link with a host. """
+        if not isinstance(url, str):
+            return False
+        parts = urlsplit(url)
+        return parts.scheme in ('http', 'https') and bool(parts.netloc)
+
+    @staticmethod
+    def valid_id(s_id) -> bool:
+        """ Returns whether the id from a request body is an integer, which a bool isn't. """
+        return isinstance(s_id, int) and not isinstance(s_id, bool)
+
+    @staticmethod
+    def search_sort(story_store: StoryStore, search: str, sort: str, order: str,
+                    start: int = 0, stop: int = None) -> tuple:
+        """ Returns a tuple of the stories between the start and stop positions,
+            the status code and the total number found, based on the values of search and sort. """
+        descending = order == 'descending'
         if search:
-            return HelpApp.search_stories(stories, search), 200
-        return stories, 200
+            found_stories, total = story_store.search(search, sort, descending, start, stop)
+            if sort and total == 0:
+                return found_stories, 404, 0
+            return found_stories, 200, total
+        return (story_store.list_stories(sort, descending, start, stop),
+                200, story_store.count())
 
     @staticmethod
     def validate_sort_order(sort: str, order: str) -> tuple:
         """ Validates that the sort and order values are valid"""
-        if sort and sort not in ['title', 'score', 'created', 'modified']:
+        if sort and sort not in SORT_PARAMS:
             return HelpApp.error_return("Invalid sort property"), 400
         if order and order not in ['ascending', 'descending']:
             return HelpApp.error_return("Invalid order property"), 400
         return None
 
+    @staticmethod
+    def validate_page(limit: str, offset: str) -> tuple:
+        """ Validates that the limit and offset values are valid"""
+        if limit and not (HelpApp.is_whole_number(limit) and 0 < int(limit) <= MAX_PAGE_SIZE):
+            return HelpApp.error_return(
+                f"Limit must be a whole number from 1 to {MAX_PAGE_SIZE}"), 400
+        if offset and not (HelpApp.is_whole_number(offset) and int(offset) <= MAX_OFFSET):
+            return HelpApp.error_return(f"Offset must be a whole number up to {MAX_OFFSET}"), 400
+        return None
+
+    @staticmethod
+    def is_whole_number(value: str) -> bool:
+        """ Returns whether the value is written in ASCII digits only, unlike
+            str.isdigit, which also accepts characters such as '²' that int rejects. """
+        return value.isascii() and value.isdigit()
+
+    @staticmethod
+    def parse_since(since: str) -> int | None:
+        """ Returns the since value, either a timestamp in TIME_FORMAT like a story's
+            updated_at or seconds since the epoch, as seconds since the epoch,
+            or None if it is neither or is later than now. """
+        if HelpApp.is_whole_number(since):
+            seconds = int(since)
+        else:
+            try:
+                seconds = parse_timestamp(since)
+            except (ValueError, KeyError):
+                return None
+        if seconds > parse_timestamp(timestamp_now()):
+            return None
+        return seconds
+
+    @staticmethod
+    def validate_batch(data) -> tuple | None:
+        """ Validates that a batch is a list of at most MAX_BATCH_SIZE operations. """
+        if not isinstance(data, list) or not data or len(data) > MAX_BATCH_SIZE:
+            return HelpApp.error_return(
+                f"Batch must be a list of 1 to {MAX_BATCH_SIZE} operations"), 400
+        if not all(isinstance(item, dict) for item in data):
+            return HelpApp.error_return("Each operation in a batch must be an object"), 400
+        return None
+
+    @staticmethod
+    def batch_result(body: dict, status: int) -> dict:
+        """ Returns the result of one operation in a batch, with its status code. """
+        return body | {"status": status}
+
+    @staticmethod
+    def not_modified(tag: str, modified: float) -> bool:
+        """ Returns whether the copy the client already has, named by If-None-Match
+            or dated by If-Modified-Since, is still current. """
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(tag)
+        if request.if_modified_since:
+            return int(modified) <= request.if_modified_since.timestamp()
+        return False
+
+    @staticmethod
+    def cache_headers(response: Response, tag: str, modified: float) -> Response:
+        """ Adds the ETag and Last-Modified headers to the response,
+            and asks clients to check them before reusing it. """
+        response.set_etag(tag)
+        response.last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+        response.cache_control.no_cache = True
+        return response
+
+    @staticmethod
+    def page_return(stories: list[dict], offset: int, total: int) -> dict:
+        """ Returns a page of stories with the offset of the next page,
+            which is None when there are no more stories. """
+        next_offset = offset + len(stories)
+        return {"stories": stories,
+                "next_offset": next_offset if next_offset < total else None,
+                "total": total}
+
     @staticmethod
     def update_story(story: dict, url: str, title: str) -> None:
         """ Updates an existing story using the input url/title. """
         if title or url:
-            story['updated_at'] = datetime.now().strftime(
-                "%a, %d %b %Y %H:%M:%S GMT")
+            story['updated_at'] = datetime.now().strftime(TIME_FORMAT)
             if title:
                 story['title'] = title
             if url:
@@ -96,18 +212,52 @@ class HelpApp():
                 story["website"] = url.split("/")[2]
 
     @staticmethod
-    def create_story(stories: list[dict], url: str, title: str) -> dict:
-        """ Creates a new story using the input url and title. """
-        if stories:
-            new_id = sorted(stories, key=lambda val: val['id'], reverse=True)[
-                0]['id'] + 1
+    def scrape_stories(story_store: StoryStore, urls: list[str],
+                       page_states: dict = None) -> dict:
+        """ Streams the pages at the urls at the same time and adds the stories found on them,
+            skipping any already on the site. Returns the counts of added and duplicate
+            stories, the urls that couldn't be fetched and, when page_states is given,
+            the urls whose pages hadn't changed since the last scrape. Pages are only
+            read whole, rather than streamed, when they are checked against page_states. """
+        failed_urls = []
+        unchanged_urls = []
+        if page_states is None:
+            titleurl_stories = stream_pages_stories(urls, failed_urls)
         else:
-            new_id = 0
+            pages = get_html_pages(urls, page_states=page_states)
+            failed_urls = [url for url, page in zip(urls, pages) if isinstance(page, Exception)]
+            unchanged_urls = [url for url, page in zip(urls, pages) if page is None]
+            titleurl_stories = [story for url, page in zip(urls, pages) if isinstance(page, str)
+                                for story in parse_stories_bs(domain_url=url, html=page)]
+        found = 0
+        scraped_stories = []
+        new_urls = set()
+        for story in titleurl_stories:
+            found += 1
+            url = normalize_url(story['url'])
+            if url not in new_urls and not story_store.has_url(story['url']):
+                new_urls.add(url)
+                scraped_stories.append(story)
+        if len(failed_urls) == len(urls):
+            raise ScrapeError("URL must be a valid url. ")
+        if not found and not unchanged_urls:
+            raise ScrapeError("No stories found.")
+        with story_store.transaction():
+            new_stories = [HelpApp.create_story(story_store.next_id(), story["url"], story['title'])
+                           for story in scraped_stories if not story_store.has_url(story['url'])]
+            if new_stories:
+                story_store.commit("create", *new_stories)
+        story_events.publish("create", *new_stories)
+        return {"added": len(new_stories), "duplicates": found - len(new_stories),
+                "failed_urls": [url for url in urls if url in failed_urls],
+                "unchanged_urls": unchanged_urls}
+
+    @staticmethod
+    def create_story(new_id: int, url: str, title: str) -> dict:
+        """ Creates a new story with the given id using the input url and title. """
         new_story = {
-            "created_at": datetime.now().strftime(
-                "%a, %d %b %Y %H:%M:%S GMT"),
-            "updated_at": datetime.now().strftime(
-                "%a, %d %b %Y %H:%M:%S GMT"),
+            "created_at": datetime.now().strftime(TIME_FORMAT),
+            "updated_at": datetime.now().strftime(TIME_FORMAT),
             "id": new_id,
             "score": 0,
             "website": url.split("/")[2],
@@ -116,6 +266,8 @@ class HelpApp():
         }
         return new_story
 
+scrape_scheduler = get_scrape_scheduler(scrape_queue, partial(HelpApp.scrape_stories, store))
+
 @app.route("/", methods=["GET"])
 def index():
     """ Returns the base HTML for the site. """
@@ -136,87 +288,246 @@ def scrape():
 @app.route("/stories", methods=["GET", "POST"])
 def get_stories():
     """ Returns all of the stories or adds a new story to the list. """
-    stories = load_from_file()
     if request.method == "GET":
         args = request.args.to_dict()
         search = args.get('search')
         sort = args.get('sort')
         order = args.get('order')
-        val_result = HelpApp.validate_sort_order(sort, order)
+        limit = args.get('limit')
+        offset = args.get('offset')
+        val_result = (HelpApp.validate_sort_order(sort, order)
+                      or HelpApp.validate_page(limit, offset))
         if val_result:
             return val_result
-        if stories:
-            return HelpApp.search_sort(stories, search, sort, order)
-        return HelpApp.error_return("No stories were found"), 404
+        tag, modified = store.version()
+        if HelpApp.not_modified(tag, modified):
+            return HelpApp.cache_headers(make_response("", 304), tag, modified)
+        start = int(offset or 0)
+        key = (search.lower() if search else None, sort, order == 'descending',
+               int(limit) if limit else None, start)
+        cached = response_cache.get(tag, key)
+        if cached:
+            response = app.response_class(cached[0], cached[1], mimetype=app.json.mimetype)
+            return HelpApp.cache_headers(response, tag, modified)
+        if store.count():
+            stop = start + int(limit) if limit else None
+            found_stories, status, total = HelpApp.search_sort(
+                store, search, sort, order, start, stop)
+            if limit:
+                found_stories = HelpApp.page_return(found_stories, start, total)
+        else:
+            found_stories, status = HelpApp.error_return("No stories were found"), 404
+        response = make_response(found_stories, status)
+        response_cache.put(tag, key, response.get_data(), status)
+        return HelpApp.cache_headers(response, tag, modified)
     data = request.get_json(silent=True)
     if "url" in data and "title" in data:
-        stories.append(HelpApp.create_story(stories, data['url'], data['title']))
-        save_to_file(stories)
+        if not HelpApp.valid_url(data['url']):
+            return HelpApp.error_return("url must be a link starting with http:// or https://"), 400
+        with store.transaction():
+            if store.has_url(data['url']):
+                return HelpApp.error_return("A story with this url already exists."), 409
+            new_story = HelpApp.create_story(store.next_id(), data['url'], data['title'])
+            store.commit("create", new_story)
+        story_events.publish("create", new_story)
         return {"message": "Added Successfully"}, 201
     return HelpApp.error_return("New story must have a url and a title."), 400
 
 
+@app.route("/stories/changes", methods=["GET"])
+def get_story_changes():
+    """ Returns the stories created or updated, and tombstones for those deleted,
+        since the given time, with the since value to ask for next time. """
+    since = HelpApp.parse_since(request.args.get('since', ''))
+    if since is None:
+        return HelpApp.error_return(
+            "since must be a timestamp like a story's updated_at, or seconds since the epoch, "
+            "no later than now"), 400
+    now = parse_timestamp(timestamp_now())
+    if since < now - TOMBSTONE_MAX_AGE:
+        return HelpApp.error_return(
+            f"Changes are only kept for {TOMBSTONE_MAX_AGE // 86400} days, "
+            "reload the stories from /stories instead"), 410
+    stories, deleted = store.changes(since)
+    # The next since trails the current time, so a change committed while these
+    # were being read is sent next time rather than missed.
+    return {"stories": stories, "deleted": deleted,
+            "since": format_timestamp(max(since, now - CHANGES_OVERLAP))}, 200
+
+
+@app.route("/stories/stream", methods=["GET"])
+def stream_story_changes():
+    """ Streams each change to the stories as a server-sent event named 'create',
+        'vote', 'update' or 'delete', whose data is a list of the changed stories. """
+    subscriber = story_events.subscribe()
+    response = Response(story_events.stream(subscriber), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(partial(story_events.unsubscribe, subscriber))
+    return response
+
+
 @app.route("/stories/<int:s_id>/votes", methods=["POST"])
 def add_vote(s_id: int):
     """ Add vote to story. """
-    stories = load_from_file()
     data = request.get_json()
     if data.get("direction") in ['up', 'down']:
-        for story in stories:
-            if story['id'] == s_id:
-                if story['score'] == 0 and data.get("direction") == 'down':
-                    return HelpApp.error_return("Can't downvote for a story with 0 votes"), 400
+        try:
+            with store.transaction():
+                story = store.get(s_id)
+                vote_error = HelpApp.check_vote(story, data.get("direction"))
+                if vote_error:
+                    return vote_error
                 HelpApp.vote_story(story, data.get('direction'))
-                save_to_file(stories)
-                return {"message": "Updated Successfully"}, 201
-        return HelpApp.error_return("ID not found"), 404
+                store.commit("vote", story)
+        except ScoreBelowZero:
+            return HelpApp.error_return("Can't downvote for a story with 0 votes"), 400
+        story_events.publish("vote", story)
+        return {"message": "Updated Successfully", "story": story}, 201
     return HelpApp.error_return("Direction must be up or down"), 400
 
 @app.route("/stories/<int:s_id>", methods=(["PATCH", "DELETE"]))
 def update_story_info(s_id: int):
     """ Updates existing story of input ID with new info or deletes existing story by ID. """
-    stories = load_from_file()
     if request.method == "PATCH":
         data = request.get_json(silent=True)
         if "url" in data or "title" in data:
-            for story in stories:
-                if story['id'] == s_id:
-                    HelpApp.update_story(
-                        story, data.get('url'), data.get('title'))
-                    save_to_file(stories)
-                    return {"message": "Updated Successfully"}, 201
-            return HelpApp.error_return("ID not found"), 404
+            if data.get('url') and not HelpApp.valid_url(data['url']):
+                return HelpApp.error_return(
+                    "url must be a link starting with http:// or https://"), 400
+            with store.transaction():
+                story = store.get(s_id)
+                if not story:
+                    return HelpApp.error_return("ID not found"), 404
+                HelpApp.update_story(story, data.get('url'), data.get('title'))
+                store.commit("update", story)
+            story_events.publish("update", story)
+            return {"message": "Updated Successfully", "story": story}, 201
         return HelpApp.error_return("Updated story data must contain url or title"), 400
-    for i, story in enumerate(stories.copy()):
-        if story['id'] == s_id:
-            stories.remove(stories[i])
-            save_to_file(stories)
-            return {"message": "Deleted Successfully"}, 201
-    return HelpApp.error_return("ID not found"), 404
+    with store.transaction():
+        story = store.get(s_id)
+        if not story:
+            return HelpApp.error_return("ID not found"), 404
+        store.commit("delete", story)
+    story_events.publish("delete", story)
+    return {"message": "Deleted Successfully"}, 201
+
+
+@app.route("/stories/batch", methods=["POST", "DELETE"])
+def batch_stories():
+    """ Adds or deletes many stories in one transaction, returning a result for each.
+        POST takes a list of {"url", "title"} and DELETE a list of {"id"}. """
+    data = request.get_json(silent=True)
+    val_result = HelpApp.validate_batch(data)
+    if val_result:
+        return val_result
+    results = []
+    with store.transaction():
+        if request.method == "POST":
+            new_stories = []
+            new_urls = set()
+            for item in data:
+                if not isinstance(item.get('url'), str) or not isinstance(item.get('title'), str):
+                    results.append(HelpApp.batch_result(HelpApp.error_return(
+                        "New story must have a url and a title."), 400))
+                elif not HelpApp.valid_url(item['url']):
+                    results.append(HelpApp.batch_result(HelpApp.error_return(
+                        "url must be a link starting with http:// or https://"), 400))
+                elif normalize_url(item['url']) in new_urls or store.has_url(item['url']):
+                    results.append(HelpApp.batch_result(HelpApp.error_return(
+                        "A story with this url already exists."), 409))
+                else:
+                    new_urls.add(normalize_url(item['url']))
+                    new_stories.append(HelpApp.create_story(
+                        store.next_id(), item['url'], item['title']))
+                    results.append(HelpApp.batch_result(
+                        {"message": "Added Successfully", "id": new_stories[-1]['id']}, 201))
+            if new_stories:
+                store.commit("create", *new_stories)
+        else:
+            deleted_stories = {}
+            for item in data:
+                s_id = item.get('id')
+                story = (store.get(s_id) if HelpApp.valid_id(s_id) and s_id not in deleted_stories
+                         else None)
+                if not story:
+                    results.append(HelpApp.batch_result(HelpApp.error_return("ID not found"), 404))
+                else:
+                    deleted_stories[s_id] = story
+                    results.append(HelpApp.batch_result({"message": "Deleted Successfully"}, 201))
+            if deleted_stories:
+                store.commit("delete", *deleted_stories.values())
+    if request.method == "POST":
+        story_events.publish("create", *new_stories)
+    else:
+        story_events.publish("delete", *deleted_stories.values())
+    return {"results": results}, 200
+
+
+@app.route("/stories/batch/votes", methods=["POST"])
+def batch_votes():
+    """ Makes many votes in one transaction, returning a result for each.
+        Takes a list of {"id", "direction"}; votes on the same story are applied in order. """
+    data = request.get_json(silent=True)
+    val_result = HelpApp.validate_batch(data)
+    if val_result:
+        return val_result
+    results = []
+    try:
+        with store.transaction():
+            voted_stories = {}
+            for item in data:
+                if item.get("direction") not in ['up', 'down']:
+                    results.append(HelpApp.batch_result(
+                        HelpApp.error_return("Direction must be up or down"), 400))
+                    continue
+                s_id = item.get('id')
+                story = None
+                if HelpApp.valid_id(s_id):
+                    story = voted_stories.get(s_id) or store.get(s_id)
+                vote_error = HelpApp.check_vote(story, item['direction'])
+                if vote_error:
+                    results.append(HelpApp.batch_result(*vote_error))
+                    continue
+                HelpApp.vote_story(story, item['direction'])
+                voted_stories[s_id] = story
+                results.append(HelpApp.batch_result({"message": "Updated Successfully"}, 201))
+            if voted_stories:
+                store.commit("vote", *voted_stories.values())
+    except ScoreBelowZero:
+        # Nothing was saved, as the whole batch is one transaction.
+        return HelpApp.error_return("Can't downvote for a story with 0 votes"), 400
+    story_events.publish("vote", *voted_stories.values())
+    return {"results": results}, 200
 
 
 @app.route("/scrape", methods=["POST"])
 def scrape_story_info():
-    """ Scrapes story information from a given link and adds this to the site. 
-        Currently only works for the BBC site. """
-    stories = load_from_file()
+    """ Queues a scrape of story information from a given link, or list of links, to add
+        to the site, returning the job's id straight away. Currently only works for the BBC site. """
     data = request.get_json(silent=True)
-    if "url" in data:
-        try:
-            bbc_html_doc = get_html(data['url'])
-        except HTTPError:
+    if "url" in data or "urls" in data:
+        urls = data['urls'] if "urls" in data else [data['url']]
+        if (not isinstance(urls, list) or not 0 < len(urls) <= MAX_SCRAPE_URLS
+                or not all(isinstance(url, str) for url in urls)):
             return HelpApp.error_return(
-                "URL must be a valid url. "), 400
-        titleurl_list = parse_stories_bs(domain_url=data['url'], html=bbc_html_doc)
-        if not titleurl_list:
-            return HelpApp.error_return("No stories found."), 404
-        for story in titleurl_list:
-            if story['url'] not in [story['url'] for story in stories]:
-                stories.append(HelpApp.create_story(stories, story["url"], story['title']))
-        save_to_file(stories)
-        return {"message": "BBC Scraped Successfully"}, 201
+                f"urls must be a list of 1 to {MAX_SCRAPE_URLS} links. "), 400
+        try:
+            job_id = scrape_queue.submit(partial(HelpApp.scrape_stories, store), urls)
+        except ScrapeQueueFull:
+            return HelpApp.error_return("Too many scrapes are queued, try again later."), 503
+        return ({"message": "Scrape queued", "job_id": job_id}, 202,
+                {"Location": f"/scrape/jobs/{job_id}"})
     return HelpApp.error_return("There must be a url header. "), 400
 
+
+@app.route("/scrape/jobs/<job_id>", methods=["GET"])
+def get_scrape_job(job_id: str):
+    """ Returns the status of a scrape job, with its counts once it is done. """
+    job = scrape_queue.get(job_id)
+    if not job:
+        return HelpApp.error_return("Job not found"), 404
+    return job, 200
+
 if __name__ == "__main__":
     app.config['TESTING'] = True
     app.config['DEBUG'] = True
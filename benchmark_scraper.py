@@ -0,0 +1,49 @@
+""" Times parse_stories_bs on a saved news page, comparing the parsers and the old full parse.
+
+    Usage: python benchmark_scraper.py [saved_page.html] [runs]
+    Save a page with: curl -o bbc_news.html https://www.bbc.co.uk/news """
+
+import sys
+import timeit
+from bs4 import BeautifulSoup
+from news_scraper import parse_stories_bs
+
+BBC_URL = "https://www.bbc.co.uk/news"
+SAVED_PAGE_PATH = "bbc_news.html"
+
+
+def parse_stories_full(domain_url, html):
+    """ The original parse, which builds the whole page with html.parser. """
+    if '//' not in domain_url.rsplit("/", 1)[0]:
+        domain_url += '/'
+    story_list = []
+    for story in BeautifulSoup(html, "html.parser").css.select(".e1vyq2e80"):
+        title_tag = story.select_one("p[class*='PromoHeadline']")
+        if not title_tag or 'Video' in str(title_tag) or len(title_tag.get_text().strip()) <= 10:
+            continue
+        story_list.append({'title': title_tag.get_text().strip(),
+                           'url': domain_url.rsplit("/", 1)[0] + story.find("a")['href']})
+    return story_list
+
+
+def benchmark(html: str, runs: int) -> None:
+    """ Prints the average time of each way of parsing the page, checking they agree. """
+    parsers = {"full page, html.parser": lambda: parse_stories_full(BBC_URL, html),
+               "promos only, html.parser": lambda: parse_stories_bs(BBC_URL, html, "html.parser")}
+    try:
+        import lxml  # pylint: disable=import-outside-toplevel,unused-import
+        parsers["promos only, lxml"] = lambda: parse_stories_bs(BBC_URL, html, "lxml")
+    except ImportError:
+        print("lxml is not installed, skipping it.")
+    expected = parse_stories_full(BBC_URL, html)
+    print(f"{len(html)} characters, {len(expected)} stories")
+    for name, parse in parsers.items():
+        assert parse() == expected, f"{name} found different stories"
+        seconds = timeit.timeit(parse, number=runs) / runs
+        print(f"{name:<26} {seconds * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    page_path = sys.argv[1] if len(sys.argv) > 1 else SAVED_PAGE_PATH
+    with open(page_path, encoding="UTF-8") as page:
+        benchmark(page.read(), int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -1,6 +1,14 @@
 """ Contains Fixtures for the tests. """
 
+import copy
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import api
 from api import app
+from response_cache import ResponseCache
+from storage import StoryStore
+from sqlite_storage import SQLiteStore
 import pytest
 
 
@@ -60,6 +68,68 @@ def test_empty_story():
     return []
 
 
+@pytest.fixture
+def test_store(tmp_path, monkeypatch, test_basic_story):
+    """ Returns a story store holding the basic stories, used by the API in place of stories.json. """
+    store = StoryStore(str(tmp_path / "stories.json"))
+    store.save(copy.deepcopy(test_basic_story))
+    monkeypatch.setattr(api, "store", store)
+    monkeypatch.setattr(api, "response_cache", ResponseCache())
+    return store
+
+
+@pytest.fixture
+def test_empty_store(tmp_path, monkeypatch, test_empty_story):
+    """ Returns a story store with no stories, used by the API in place of stories.json. """
+    store = StoryStore(str(tmp_path / "stories.json"))
+    store.save(test_empty_story)
+    monkeypatch.setattr(api, "store", store)
+    monkeypatch.setattr(api, "response_cache", ResponseCache())
+    return store
+
+
+@pytest.fixture
+def test_journal_store(tmp_path, monkeypatch, test_basic_story):
+    """ Returns a journaled story store holding the basic stories, used by the API. """
+    store = StoryStore(str(tmp_path / "stories.json"), journal=True)
+    store.save(copy.deepcopy(test_basic_story))
+    monkeypatch.setattr(api, "store", store)
+    monkeypatch.setattr(api, "response_cache", ResponseCache())
+    return store
+
+
+@pytest.fixture(params=["json", "journal", "sqlite", "postgres"])
+def test_empty_backend(request, tmp_path, monkeypatch):
+    """ Returns each kind of store, holding no stories, used by the API.
+        The PostgreSQL store needs a database given by TEST_DATABASE_URL. """
+    if request.param == "postgres":
+        if not os.environ.get("TEST_DATABASE_URL"):
+            pytest.skip("TEST_DATABASE_URL is not set")
+        postgres_storage = pytest.importorskip("postgres_storage")
+        with postgres_storage.psycopg2.connect(os.environ["TEST_DATABASE_URL"]) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("DROP TABLE IF EXISTS stories, store_version, tombstones; "
+                               "DROP SEQUENCE IF EXISTS story_id_seq, store_version_seq")
+        connection.close()
+        store = postgres_storage.PostgresStore(os.environ["TEST_DATABASE_URL"])
+        request.addfinalizer(store.close)
+    elif request.param == "sqlite":
+        store = SQLiteStore(str(tmp_path / "stories.db"))
+        request.addfinalizer(store.close)
+    else:
+        store = StoryStore(str(tmp_path / "stories.json"), journal=request.param == "journal")
+    monkeypatch.setattr(api, "store", store)
+    monkeypatch.setattr(api, "response_cache", ResponseCache())
+    return store
+
+
+@pytest.fixture
+def test_backend(test_empty_backend, test_basic_story):
+    """ Returns each kind of store holding the basic stories, used by the API. """
+    test_empty_backend.save(copy.deepcopy(test_basic_story))
+    return test_empty_backend
+
+
 @pytest.fixture
 def test_url():
     """ Returns a URL request body. """
@@ -281,3 +351,52 @@ def test_normal_story_B():
 <a href="/news/environment-67890">Read more</a>
 </div>
 """
+
+
+@pytest.fixture
+def test_http_server():
+    """ Returns a local HTTP server serving the HTML in its pages dict by path.
+        When a barrier is set, each request waits at it before being answered.
+        When etags is set, pages carry an ETag and a matching If-None-Match gets a 304.
+        The status of every response is kept in statuses. """
+    class Handler(BaseHTTPRequestHandler):
+        """ Answers GET requests from the server's pages. """
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """ Sends the page for the path, or a not found error. """
+            if server.barrier and self.path in server.pages:
+                server.barrier.wait()
+            page = server.pages.get(self.path)
+            if page is None:
+                server.statuses.append(404)
+                self.send_error(404)
+                return
+            body = page.encode("utf_8")
+            etag = f'"{hash(page)}"'
+            if server.etags and self.headers.get("If-None-Match") == etag:
+                server.statuses.append(304)
+                self.send_response(304)
+                self.end_headers()
+                return
+            server.statuses.append(200)
+            self.send_response(200)
+            if server.etags:
+                self.send_header("ETag", etag)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            """ Keeps the test output quiet. """
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.pages = {}
+    server.barrier = None
+    server.etags = False
+    server.statuses = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
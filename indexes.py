@@ -0,0 +1,105 @@
+""" Contains indexes that keep the stories ordered for fast listing. """
+
+from bisect import bisect_left, insort
+
+
+class SortedIndex():
+    """ Keeps story ids in order of a sort key, so a sorted listing is a walk
+        over the index. Changing one story only moves its own entry. Ties are
+        ordered by id. """
+
+    def __init__(self):
+        self._entries = []
+        self._keys = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def build(self, keys: dict) -> None:
+        """ Replaces the index with the given keys, a dict of story id to sort key. """
+        self._keys = dict(keys)
+        self._entries = sorted((key, s_id) for s_id, key in self._keys.items())
+
+    def key(self, s_id: int):
+        """ Returns the key the story is indexed under, or None if it isn't in the index. """
+        return self._keys.get(s_id)
+
+    def add(self, s_id: int, key) -> None:
+        """ Adds a story to the index, or moves it if its key has changed. """
+        if s_id in self._keys:
+            if self._keys[s_id] == key:
+                return
+            self.remove(s_id)
+        self._keys[s_id] = key
+        insort(self._entries, (key, s_id))
+
+    def remove(self, s_id: int) -> None:
+        """ Removes a story from the index if it is in it. """
+        if s_id not in self._keys:
+            return
+        key = self._keys.pop(s_id)
+        del self._entries[bisect_left(self._entries, (key, s_id))]
+
+    def ids_from(self, key) -> list[int]:
+        """ Returns the ids of the stories indexed under the given key or later, in order. """
+        return [s_id for _, s_id in self._entries[bisect_left(self._entries, (key,)):]]
+
+    def ids(self, reverse: bool = False, start: int = 0, stop: int = None) -> list[int]:
+        """ Returns the story ids in order between the start and stop positions,
+            counting from the end of the index when reverse is True. """
+        if reverse:
+            size = len(self._entries)
+            stop = size if stop is None else min(stop, size)
+            entries = self._entries[size - stop:max(size - start, 0)][::-1]
+        else:
+            entries = self._entries[start:stop]
+        return [s_id for _, s_id in entries]
+
+
+class SearchIndex():
+    """ An inverted index from each three letter sequence (trigram) in the
+        lowercased titles to the ids of the stories containing it. Any search
+        term of three or more letters, including part of a word, is answered
+        by intersecting the postings of its trigrams and checking the few
+        stories left. Shorter terms fall back to checking every title. """
+
+    GRAM_SIZE = 3
+
+    def __init__(self):
+        self._titles = {}
+        self._postings = {}
+
+    @classmethod
+    def _grams(cls, text: str) -> set[str]:
+        """ Returns the set of trigrams in the text. """
+        return {text[i:i + cls.GRAM_SIZE] for i in range(len(text) - cls.GRAM_SIZE + 1)}
+
+    def add(self, s_id: int, title: str) -> None:
+        """ Adds a story's title to the index, or replaces it if the title has changed. """
+        title = title.lower()
+        if self._titles.get(s_id) == title:
+            return
+        self.remove(s_id)
+        self._titles[s_id] = title
+        for gram in self._grams(title):
+            self._postings.setdefault(gram, set()).add(s_id)
+
+    def remove(self, s_id: int) -> None:
+        """ Removes a story from the index if it is in it. """
+        title = self._titles.pop(s_id, None)
+        if title is None:
+            return
+        for gram in self._grams(title):
+            self._postings[gram].discard(s_id)
+            if not self._postings[gram]:
+                del self._postings[gram]
+
+    def search(self, term: str) -> list[int]:
+        """ Returns the ids, in id order, of the stories whose title contains the term,
+            ignoring case. """
+        term = term.lower()
+        if len(term) < self.GRAM_SIZE:
+            return sorted(s_id for s_id, title in self._titles.items() if term in title)
+        postings = sorted((self._postings.get(gram, set()) for gram in self._grams(term)), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return sorted(s_id for s_id in candidates if term in self._titles[s_id])
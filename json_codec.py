@@ -0,0 +1,32 @@
+""" Contains the JSON codec shared by the stores and the API's responses. """
+
+import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode(data, pretty: bool = False, sort_keys: bool = False, default=None) -> bytes:
+    """ Encodes the data as UTF-8 JSON, with orjson when it is installed, and with the
+        json module otherwise. The output is compact unless pretty is set, when it is
+        indented by two spaces. Values JSON has no type for are passed to default. """
+    if orjson:
+        option = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS)
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(data, default=default, option=option)
+    return json.dumps(data, indent=2 if pretty else None,
+                      separators=(",", ": ") if pretty else (",", ":"),
+                      sort_keys=sort_keys, default=default, ensure_ascii=False).encode()
+
+
+def decode(data: str | bytes):
+    """ Decodes JSON text or UTF-8 bytes, with orjson when it is installed. Malformed
+        input raises json.JSONDecodeError, which orjson's error is a subclass of. """
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
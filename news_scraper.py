@@ -1,45 +1,311 @@
 """ Contains functions to scrape news from a website. """
 
-from urllib.request import urlopen
-from requests import HTTPError
-from bs4 import BeautifulSoup
+import os
+import codecs
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from queue import Queue
+from urllib.parse import urljoin, urlsplit
+from requests import HTTPError, RequestException, Session
+from requests.adapters import HTTPAdapter
+import soupsieve
+from bs4 import BeautifulSoup, SoupStrainer
+try:
+    import lxml  # pylint: disable=unused-import
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
 
+FETCH_TIMEOUT = 10
+MAX_FETCH_WORKERS = 8
+MAX_PAGE_BYTES = int(os.environ.get("SCRAPE_MAX_BYTES", 5 * 1024 * 1024))
+CHUNK_SIZE = 64 * 1024
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+             'link', 'meta', 'source', 'track', 'wbr'}
 
-def get_html(url):
-    """ Get HTML from a URL. """
+
+def make_session(pool_size: int = MAX_FETCH_WORKERS) -> Session:
+    """ Returns a session that keeps up to pool_size connections open per host for reuse. """
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+SESSION = make_session()
+
+
+def iter_page(response, max_bytes: int = MAX_PAGE_BYTES):
+    """ Yields the body of a streamed response in chunks, raising an HTTPError
+        as soon as it is found to be larger than max_bytes. """
+    if int(response.headers.get('Content-Length', 0)) > max_bytes:
+        raise HTTPError(f"Page is larger than {max_bytes} bytes. ")
+    read_bytes = 0
+    for chunk in response.iter_content(CHUNK_SIZE):
+        read_bytes += len(chunk)
+        if read_bytes > max_bytes:
+            raise HTTPError(f"Page is larger than {max_bytes} bytes. ")
+        yield chunk
+
+
+def get_html(url, session: Session = None, timeout: float = FETCH_TIMEOUT,
+             max_bytes: int = MAX_PAGE_BYTES):
+    """ Get HTML from a URL, reusing the shared session's connections.
+        Raises an HTTPError if the page is larger than max_bytes. """
     try:
-        with urlopen(url) as urlpage:
-            page = urlpage
-            html_bytes = page.read()
-            html_doc = html_bytes.decode("utf_8")
-    except ValueError as err:
+        with (session or SESSION).get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            html_doc = b"".join(iter_page(response, max_bytes)).decode("utf_8")
+    except HTTPError:
+        raise
+    except (ValueError, RequestException) as err:
         raise HTTPError("Invalid Link. ") from err
     return html_doc
 
-def parse_stories_bs(domain_url, html):
-    """ Create a list of story dictionaries containing title and url for input HTML. """
-    if '//' not in domain_url.rsplit("/", 1)[0]:
-        domain_url += '/'
-    stories_list = []
-    soup = BeautifulSoup(html, "html.parser")
-    stories_list = soup.css.select(".e1vyq2e80")
-    story_list = []
-    for story in stories_list:
-        title_tag = story.select_one("p[class*='PromoHeadline']")
-        if not title_tag:
-            continue
-        if 'Video' in str(title_tag):
-            continue
-        if len(title_tag.get_text().strip()) <= 10:
-            continue
-        story_dict = {}
-        story_dict['title'] = title_tag.get_text().strip()
-        print(domain_url.rsplit("/", 1))
-        story_dict['url'] = domain_url.rsplit("/", 1)[0] + story.find("a")['href']
-        print(story_dict['url'])
-        story_list.append(story_dict)
-    return story_list
 
+def get_changed_html(url, page_state: dict, session: Session = None,
+                     timeout: float = FETCH_TIMEOUT, max_bytes: int = MAX_PAGE_BYTES):
+    """ Get HTML from a URL only if it has changed since it was last fetched, or None.
+        page_state holds the ETag, Last-Modified and content hash of the last fetch
+        and is updated. They are sent as a conditional request, so an unchanged page
+        is usually a 304 with no body; otherwise an unchanged hash skips the decode.
+        Raises an HTTPError if the page is larger than max_bytes. """
+    headers = {}
+    if page_state.get('etag'):
+        headers['If-None-Match'] = page_state['etag']
+    if page_state.get('last_modified'):
+        headers['If-Modified-Since'] = page_state['last_modified']
+    try:
+        with (session or SESSION).get(url, headers=headers, stream=True,
+                                      timeout=timeout) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            content = b"".join(iter_page(response, max_bytes))
+        content_hash = hashlib.sha256(content).hexdigest()
+        changed = content_hash != page_state.get('hash')
+        page_state.update(etag=response.headers.get('ETag'),
+                          last_modified=response.headers.get('Last-Modified'),
+                          hash=content_hash)
+        html_doc = content.decode("utf_8") if changed else None
+    except HTTPError:
+        raise
+    except (ValueError, RequestException) as err:
+        raise HTTPError("Invalid Link. ") from err
+    return html_doc
+
+
+def get_html_pages(urls: list[str], max_workers: int = MAX_FETCH_WORKERS,
+                   timeout: float = FETCH_TIMEOUT, page_states: dict = None,
+                   max_bytes: int = MAX_PAGE_BYTES) -> list:
+    """ Gets the HTML from each URL at the same time on a pool of at most max_workers
+        threads, so the wait is for the slowest page rather than all of them.
+        Returns the HTML, or the HTTPError raised, for each URL in order.
+        When page_states, a dict of URL to page state, is given, pages that haven't
+        changed since they were last fetched are None. """
+    if page_states is not None:
+        for url in urls:
+            page_states.setdefault(url, {})
+
+    def fetch(url):
+        try:
+            if page_states is not None:
+                return get_changed_html(url, page_states[url], timeout=timeout,
+                                        max_bytes=max_bytes)
+            return get_html(url, timeout=timeout, max_bytes=max_bytes)
+        except HTTPError as err:
+            return err
+
+    with ThreadPoolExecutor(max_workers=max(min(max_workers, len(urls)), 1)) as pool:
+        return list(pool.map(fetch, urls))
+
+class Extractor():
+    """ Describes how to find the stories on one site's pages: the class that marks
+        each story's promo, the selectors for its headline and link, and the
+        headlines to skip. The selectors are compiled once and reused. """
+
+    def __init__(self, promo_class: str, headline_selector: str, link_selector: str = "a",
+                 skip_text: tuple = (), min_title_length: int = 0):
+        self.promo_class = promo_class
+        self.headline_selector = soupsieve.compile(headline_selector)
+        self.link_selector = soupsieve.compile(link_selector)
+        self.skip_text = skip_text
+        self.min_title_length = min_title_length
+        self.strainer = SoupStrainer(class_=self.is_promo)
+
+    def is_promo(self, classes: str | None) -> bool:
+        """ Returns whether an element's class attribute marks it as a story promo. """
+        return classes is not None and self.promo_class in classes.split()
+
+    def join_url(self, domain_url: str, href: str) -> str:
+        """ Returns the full url of a story's link found on the page at domain_url. """
+        return urljoin(domain_url, href)
+
+    def parse(self, domain_url: str, html: str, parser: str = PARSER) -> list[dict]:
+        """ Returns the title and url of each story on the page.
+            Only the story promos are built into the tree. """
+        soup = BeautifulSoup(html, parser, parse_only=self.strainer)
+        story_list = []
+        for story in soup.find_all(class_=self.promo_class):
+            title_tag = self.headline_selector.select_one(story)
+            if not title_tag:
+                continue
+            if any(text in str(title_tag) for text in self.skip_text):
+                continue
+            title = title_tag.get_text().strip()
+            if len(title) <= self.min_title_length:
+                continue
+            link_tag = self.link_selector.select_one(story)
+            story_list.append({'title': title,
+                               'url': self.join_url(domain_url, link_tag['href'])})
+        return story_list
+
+
+class BBCExtractor(Extractor):
+    """ Finds the stories on BBC News pages, skipping videos and the short
+        headlines of links to other language and region pages. """
+
+    def __init__(self):
+        super().__init__("e1vyq2e80", "p[class*='PromoHeadline']",
+                         skip_text=('Video',), min_title_length=10)
+
+    def join_url(self, domain_url: str, href: str) -> str:
+        """ Returns the story's link added to the page's url up to its last path segment. """
+        if '//' not in domain_url.rsplit("/", 1)[0]:
+            domain_url += '/'
+        return domain_url.rsplit("/", 1)[0] + href
+
+
+EXTRACTORS = {}
+DEFAULT_EXTRACTOR = BBCExtractor()
+
+
+def register_extractor(domain: str, extractor: Extractor) -> None:
+    """ Uses the extractor for pages on the domain and its subdomains. """
+    EXTRACTORS[domain.lower()] = extractor
+
+
+def get_extractor(url: str) -> Extractor:
+    """ Returns the extractor registered for the url's host, or for the closest domain
+        above it, falling back to the BBC's. """
+    host = urlsplit(url).hostname or ""
+    parts = host.split(".")
+    for i in range(len(parts)):
+        extractor = EXTRACTORS.get(".".join(parts[i:]))
+        if extractor:
+            return extractor
+    return DEFAULT_EXTRACTOR
+
+
+register_extractor("bbc.co.uk", DEFAULT_EXTRACTOR)
+register_extractor("bbc.com", DEFAULT_EXTRACTOR)
+
+
+def parse_stories_bs(domain_url, html, parser: str = PARSER):
+    """ Create a list of story dictionaries containing title and url for input HTML,
+        using the extractor for the site, and lxml when it is installed. """
+    return get_extractor(domain_url).parse(domain_url, html, parser)
+
+
+class PromoParser(HTMLParser):
+    """ Reads a page fed to it in pieces, keeping only the markup of each story
+        promo, which is collected once the promo's element is closed. """
+
+    def __init__(self, extractor: Extractor = DEFAULT_EXTRACTOR):
+        super().__init__(convert_charrefs=False)
+        self.extractor = extractor
+        self._open_tags = []
+        self._markup = []
+        self.promos = []
+
+    def handle_starttag(self, tag, attrs):
+        if not self._open_tags and not self.extractor.is_promo(dict(attrs).get('class')):
+            return
+        self._markup.append(self.get_starttag_text())
+        if tag not in VOID_TAGS:
+            self._open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if self._open_tags:
+            self._markup.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if tag not in self._open_tags:
+            return
+        self._markup.append(f"</{tag}>")
+        while self._open_tags.pop() != tag:
+            pass
+        if not self._open_tags:
+            self.promos.append("".join(self._markup))
+            self._markup = []
+
+    def handle_data(self, data):
+        if self._open_tags:
+            self._markup.append(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name):
+        self.handle_data(f"&#{name};")
+
+    def stories(self, domain_url) -> list[dict]:
+        """ Returns the stories in the promos collected since the last call. """
+        promos, self.promos = self.promos, []
+        return [story for promo in promos for story in self.extractor.parse(domain_url, promo)]
+
+
+def stream_stories(url, max_bytes: int = MAX_PAGE_BYTES, session: Session = None,
+                   timeout: float = FETCH_TIMEOUT):
+    """ Yields the stories on the page at a URL as each promo is read, so the whole
+        page is never held in memory. Raises an HTTPError if the page can't be
+        fetched or is larger than max_bytes. """
+    decoder = codecs.getincrementaldecoder("utf_8")()
+    parser = PromoParser(get_extractor(url))
+    try:
+        with (session or SESSION).get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for chunk in iter_page(response, max_bytes):
+                parser.feed(decoder.decode(chunk))
+                yield from parser.stories(url)
+            parser.feed(decoder.decode(b"", final=True))
+            parser.close()
+            yield from parser.stories(url)
+    except HTTPError:
+        raise
+    except (ValueError, RequestException) as err:
+        raise HTTPError("Invalid Link. ") from err
+
+
+def stream_pages_stories(urls: list[str], failed_urls: list[str],
+                         max_workers: int = MAX_FETCH_WORKERS, max_bytes: int = MAX_PAGE_BYTES):
+    """ Streams the pages at the URLs at the same time on a pool of at most max_workers
+        threads, yielding their stories as they are read. URLs whose pages couldn't be
+        fetched are added to failed_urls. """
+    found = Queue()
+    finished = object()
+
+    def stream(url):
+        try:
+            for story in stream_stories(url, max_bytes):
+                found.put(story)
+        except HTTPError:
+            failed_urls.append(url)
+        finally:
+            found.put(finished)
+
+    with ThreadPoolExecutor(max_workers=max(min(max_workers, len(urls)), 1)) as pool:
+        for url in urls:
+            pool.submit(stream, url)
+        remaining = len(urls)
+        while remaining:
+            story = found.get()
+            if story is finished:
+                remaining -= 1
+            else:
+                yield story
 
 if __name__ == "__main__":
     BBC_URL = "http://bbc.co.uk/news"
@@ -0,0 +1,341 @@
+""" Contains a PostgreSQL store for the stories, used in place of stories.json. """
+
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from storage import (TIME_FORMAT, TOMBSTONE_MAX_AGE, ScoreBelowZero, normalize_url,
+                     timestamp_now)
+
+POOL_SIZE = 10
+POOL_TIMEOUT = 30
+
+SORT_COLUMNS = {'title': 'upper(title) COLLATE "C"', 'score': 'score',
+                'created': 'created_at', 'modified': 'updated_at'}
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS stories (
+           id BIGINT PRIMARY KEY,
+           title TEXT NOT NULL,
+           url TEXT NOT NULL,
+           url_key TEXT NOT NULL,
+           website TEXT NOT NULL,
+           score INTEGER NOT NULL DEFAULT 0 CHECK (score >= 0),
+           created_at TIMESTAMP NOT NULL,
+           updated_at TIMESTAMP NOT NULL)""",
+    "CREATE SEQUENCE IF NOT EXISTS story_id_seq MINVALUE 0 START 0",
+    "CREATE SEQUENCE IF NOT EXISTS store_version_seq",
+    """CREATE TABLE IF NOT EXISTS tombstones (
+           id BIGINT PRIMARY KEY,
+           deleted_at TIMESTAMP NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS stories_url_key_idx ON stories (url_key)",
+    "CREATE INDEX IF NOT EXISTS stories_score_idx ON stories (score, id)",
+    "CREATE INDEX IF NOT EXISTS stories_created_at_idx ON stories (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS stories_updated_at_idx ON stories (updated_at, id)",
+    'CREATE INDEX IF NOT EXISTS stories_title_idx ON stories ((upper(title) COLLATE "C"), id)',
+    "CREATE INDEX IF NOT EXISTS tombstones_deleted_at_idx ON tombstones (deleted_at, id)",
+]
+
+TRIGRAM_SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS stories_title_trgm_idx ON stories USING gin (title gin_trgm_ops)",
+]
+
+SYNC_ID_SEQUENCE = """SELECT setval('story_id_seq', GREATEST(
+    (SELECT COALESCE(MAX(id) + 1, 0) FROM stories),
+    (SELECT CASE WHEN is_called THEN last_value + 1 ELSE last_value END FROM story_id_seq)),
+    false)"""
+
+BUMP_VERSION = "SELECT nextval('store_version_seq')"
+
+# Until its first nextval a sequence reports its start value with is_called false,
+# so that is read as 0 to let the first write change the version.
+SELECT_VERSION = """SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS version,
+    extract(epoch FROM GREATEST(
+    (SELECT MAX(updated_at) FROM stories),
+    (SELECT MAX(deleted_at) FROM tombstones),
+    'epoch'::timestamp)) AS modified
+    FROM store_version_seq"""
+
+INSERT_STORY = """INSERT INTO stories
+    (id, title, url, url_key, website, score, created_at, updated_at)
+    VALUES (%(id)s, %(title)s, %(url)s, %(url_key)s, %(website)s, %(score)s,
+            %(created_at)s, %(updated_at)s)"""
+
+
+def to_row(story: dict) -> dict:
+    """ Returns the column values for a story. """
+    return {**story, "url_key": normalize_url(story['url']),
+            "created_at": datetime.strptime(story['created_at'], TIME_FORMAT),
+            "updated_at": datetime.strptime(story['updated_at'], TIME_FORMAT)}
+
+
+def to_story(row: dict) -> dict:
+    """ Returns the story for a row, in the same form as stories.json. """
+    return {"created_at": row['created_at'].strftime(TIME_FORMAT),
+            "id": row['id'],
+            "score": row['score'],
+            "title": row['title'],
+            "updated_at": row['updated_at'].strftime(TIME_FORMAT),
+            "url": row['url'],
+            "website": row['website']}
+
+
+def like_pattern(search_term: str) -> str:
+    """ Returns an ILIKE pattern matching titles that contain the search term. """
+    escaped = search_term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class PostgresStore():
+    """ Keeps the stories in a PostgreSQL table, with the same methods as StoryStore,
+        so many stateless API workers can share one database.
+
+        Connections come from a pool of up to max_connections. A thread that finds
+        them all in use waits up to pool_timeout seconds for one to be put back,
+        then gets a PoolError. Searching, sorting and paging are done in
+        SQL using indexes on the url, score, timestamps and title, and a vote is
+        a single relative update of the score. Writers only wait for each other
+        when they add the same url or change the same story. """
+
+    def __init__(self, dsn: str, min_connections: int = 1, max_connections: int = POOL_SIZE,
+                 pool_timeout: float = POOL_TIMEOUT):
+        self._pool = ThreadedConnectionPool(min_connections, max_connections, dsn)
+        self._free = threading.BoundedSemaphore(max_connections)
+        self.pool_timeout = pool_timeout
+        self._local = threading.local()
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        """ Creates the table, its indexes and the id sequence if they don't exist. """
+        with self._cursor() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+        try:
+            with self._cursor() as cursor:
+                for statement in TRIGRAM_SCHEMA:
+                    cursor.execute(statement)
+        except psycopg2.Error:
+            # pg_trgm needs extra privileges; searches still work without its index.
+            pass
+        with self._cursor() as cursor:
+            cursor.execute(SYNC_ID_SEQUENCE)
+
+    def _getconn(self):
+        """ Returns a pooled connection, waiting for one to be put back if all are in use. """
+        if not self._free.acquire(timeout=self.pool_timeout):
+            raise PoolError(f"no database connection was free within {self.pool_timeout}s")
+        try:
+            return self._pool.getconn()
+        except BaseException:
+            self._free.release()
+            raise
+
+    def _putconn(self, connection) -> None:
+        """ Returns the connection to the pool and wakes a thread waiting for one. """
+        try:
+            self._pool.putconn(connection)
+        finally:
+            self._free.release()
+
+    @contextmanager
+    def _cursor(self):
+        """ Yields a cursor on the current transaction's connection, or on a pooled
+            connection that is committed as soon as the cursor is done with. """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                yield cursor
+            return
+        connection = self._getconn()
+        try:
+            with connection:
+                with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                    yield cursor
+        finally:
+            self._putconn(connection)
+
+    @contextmanager
+    def transaction(self):
+        """ Runs everything inside it on one connection, committed at the end,
+            and then moves the version on if anything was written.
+            Transactions on the same thread can be nested. """
+        if getattr(self._local, 'connection', None) is not None:
+            yield
+            return
+        connection = self._getconn()
+        self._local.connection = connection
+        self._local.scores = {}
+        self._local.changed = False
+        try:
+            with connection:
+                yield
+            if self._local.changed:
+                # Bumped only once the changes are committed, so a reader never
+                # caches the old stories under the new version.
+                with connection:
+                    with connection.cursor() as cursor:
+                        cursor.execute(BUMP_VERSION)
+        finally:
+            self._local.connection = None
+            self._putconn(connection)
+
+    def close(self) -> None:
+        """ Closes all of the pooled connections. """
+        self._pool.closeall()
+
+    def load(self) -> list[dict]:
+        """ Returns all of the stories in the order they were added. """
+        return self.list_stories()
+
+    def get(self, s_id: int) -> dict | None:
+        """ Returns the story with the given id, or None if there isn't one.
+            Inside a transaction the row is locked until it commits, so the score
+            a vote is checked against can't change underneath it. """
+        in_transaction = getattr(self._local, 'connection', None) is not None
+        with self._cursor() as cursor:
+            cursor.execute("SELECT * FROM stories WHERE id = %s"
+                           + (" FOR UPDATE" if in_transaction else ""), (s_id,))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        if in_transaction:
+            self._local.scores[s_id] = row['score']
+        return to_story(row)
+
+    def count(self) -> int:
+        """ Returns the number of stories. """
+        with self._cursor() as cursor:
+            cursor.execute("SELECT count(*) AS total FROM stories")
+            return cursor.fetchone()['total']
+
+    def has_url(self, url: str) -> bool:
+        """ Returns whether there is already a story for the url, once normalized.
+            Inside a transaction the url is locked until it commits, so another worker
+            checking the same url waits and then sees the story this one adds. """
+        url_key = normalize_url(url)
+        with self._cursor() as cursor:
+            if getattr(self._local, 'connection', None) is not None:
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (url_key,))
+            cursor.execute("SELECT 1 FROM stories WHERE url_key = %s LIMIT 1", (url_key,))
+            return cursor.fetchone() is not None
+
+    def next_id(self) -> int:
+        """ Hands out the id for a new story from a sequence, so ids are never reused. """
+        with self._cursor() as cursor:
+            cursor.execute("SELECT nextval('story_id_seq') AS id")
+            return cursor.fetchone()['id']
+
+    def version(self) -> tuple[str, float]:
+        """ Returns a counter that goes up with every change to the stories,
+            and the time of the last change. The counter is a sequence rather than
+            a row, so writers never wait on each other to move it on. """
+        with self._cursor() as cursor:
+            cursor.execute(SELECT_VERSION)
+            row = cursor.fetchone()
+        return str(row['version']), float(row['modified'])
+
+    def changes(self, since: int) -> tuple[list[dict], list[dict]]:
+        """ Returns the stories updated at or after since, in seconds since the epoch,
+            in order of their update, and the tombstones of those deleted since then. """
+        since_at = datetime.fromtimestamp(since, timezone.utc).replace(tzinfo=None)
+        with self._cursor() as cursor:
+            cursor.execute("SELECT * FROM stories WHERE updated_at >= %s ORDER BY updated_at, id",
+                           (since_at,))
+            stories = [to_story(row) for row in cursor.fetchall()]
+            cursor.execute("SELECT id, deleted_at FROM tombstones WHERE deleted_at >= %s "
+                           "ORDER BY deleted_at, id", (since_at,))
+            tombstones = [{"id": row['id'], "deleted_at": row['deleted_at'].strftime(TIME_FORMAT)}
+                          for row in cursor.fetchall()]
+        return stories, tombstones
+
+    @staticmethod
+    def _order_by(sort_param: str, descending: bool) -> str:
+        """ Returns the ORDER BY clause for the sort property, with ties in id order. """
+        direction = "DESC" if descending else "ASC"
+        if not sort_param:
+            return "ORDER BY id"
+        return f"ORDER BY {SORT_COLUMNS[sort_param]} {direction}, id {direction}"
+
+    def list_stories(self, sort_param: str = None, descending: bool = False,
+                     start: int = 0, stop: int = None) -> list[dict]:
+        """ Returns the stories between the start and stop positions, in order of the
+            sort property, or in the order they were added. """
+        limit = None if stop is None else max(stop - start, 0)
+        with self._cursor() as cursor:
+            cursor.execute(f"SELECT * FROM stories {self._order_by(sort_param, descending)} "
+                           "LIMIT %s OFFSET %s", (limit, start))
+            return [to_story(row) for row in cursor.fetchall()]
+
+    def search(self, search_term: str, sort_param: str = None, descending: bool = False,
+               start: int = 0, stop: int = None) -> tuple[list[dict], int]:
+        """ Returns the stories between the start and stop positions that have the
+            search term in their title, ignoring case, along with the number found. """
+        limit = None if stop is None else max(stop - start, 0)
+        pattern = like_pattern(search_term)
+        with self._cursor() as cursor:
+            cursor.execute("SELECT *, count(*) OVER () AS total FROM stories WHERE title ILIKE %s "
+                           f"{self._order_by(sort_param, descending)} LIMIT %s OFFSET %s",
+                           (pattern, limit, start))
+            rows = cursor.fetchall()
+            if rows:
+                return [to_story(row) for row in rows], rows[0]['total']
+            cursor.execute("SELECT count(*) AS total FROM stories WHERE title ILIKE %s",
+                           (pattern,))
+            return [], cursor.fetchone()['total']
+
+    def save(self, stories: list[dict]) -> None:
+        """ Replaces all of the stories in the table with the given stories. """
+        with self.transaction():
+            with self._cursor() as cursor:
+                cursor.execute("DELETE FROM stories")
+                cursor.executemany(INSERT_STORY, [to_row(story) for story in stories])
+                cursor.execute(SYNC_ID_SEQUENCE)
+            self._local.changed = True
+
+    def commit(self, op: str, *stories: dict) -> None:
+        """ Writes a 'create', 'vote', 'update' or 'delete' of the stories to the table,
+            leaving a tombstone for each deleted story. A vote on a story read in the
+            same transaction is written as the change in its score, so concurrent votes
+            are never lost. """
+        with self.transaction():
+            self._write(op, stories)
+            self._local.changed = True
+
+    def _write(self, op: str, stories: tuple[dict]) -> None:
+        """ Writes the change to the stories on the current transaction's connection. """
+        scores = self._local.scores
+        deleted_at = datetime.strptime(timestamp_now(), TIME_FORMAT)
+        with self._cursor() as cursor:
+            if op == 'delete':
+                cursor.execute(
+                    "DELETE FROM tombstones WHERE deleted_at < %s - %s * interval '1 second'",
+                    (deleted_at, TOMBSTONE_MAX_AGE))
+            for story in stories:
+                if op == 'create':
+                    cursor.execute(INSERT_STORY, to_row(story))
+                elif op == 'delete':
+                    cursor.execute("DELETE FROM stories WHERE id = %s", (story['id'],))
+                    cursor.execute(
+                        """INSERT INTO tombstones (id, deleted_at) VALUES (%s, %s)
+                           ON CONFLICT (id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at""",
+                        (story['id'], deleted_at))
+                elif op == 'update':
+                    cursor.execute(
+                        """UPDATE stories SET title = %(title)s, url = %(url)s,
+                           url_key = %(url_key)s, website = %(website)s,
+                           updated_at = %(updated_at)s WHERE id = %(id)s""", to_row(story))
+                elif story['id'] in scores:
+                    delta = story['score'] - scores.pop(story['id'])
+                    cursor.execute(
+                        """UPDATE stories SET score = score + %s, updated_at = %s
+                           WHERE id = %s AND score + %s >= 0""",
+                        (delta, to_row(story)['updated_at'], story['id'], delta))
+                    if cursor.rowcount == 0:
+                        raise ScoreBelowZero(f"Story {story['id']} can't go below 0 votes")
+                else:
+                    cursor.execute(
+                        "UPDATE stories SET score = %s, updated_at = %s WHERE id = %s",
+                        (story['score'], to_row(story)['updated_at'], story['id']))
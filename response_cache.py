@@ -0,0 +1,65 @@
+""" Contains a cache of rendered story listings. """
+
+import os
+import threading
+from collections import OrderedDict
+
+RESPONSE_CACHE_ENTRIES = 256
+RESPONSE_CACHE_BYTES = 32 * 1024 * 1024
+
+
+class ResponseCache():
+    """ Keeps the JSON bytes of recent responses, keyed by their query, so a repeated
+        listing is sent without searching, sorting or encoding it again.
+
+        Entries belong to one version of the stories and are all dropped as soon
+        as a different version is asked for. The version also changes when
+        another process changes the stories, so that is the only kind of
+        invalidation that is safe. The least recently used entries are dropped
+        once there are more than max_entries or they hold more than max_bytes. """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_ENTRIES,
+                 max_bytes: int = RESPONSE_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_version(self, version: str) -> None:
+        """ Drops every entry if they belong to a different version of the stories. """
+        if version != self._version:
+            self._entries.clear()
+            self._size = 0
+            self._version = version
+
+    def get(self, version: str, key: tuple) -> tuple[bytes, int] | None:
+        """ Returns the body and status code cached for the query, or None. """
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, version: str, key: tuple, body: bytes, status: int) -> None:
+        """ Caches the body and status code of the response to the query. """
+        if not self.max_entries or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key)[0])
+            self._entries[key] = (body, status)
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._size -= len(self._entries.popitem(last=False)[1][0])
+
+
+def get_response_cache() -> ResponseCache:
+    """ Returns a response cache holding up to RESPONSE_CACHE_ENTRIES responses. """
+    return ResponseCache(int(os.environ.get("RESPONSE_CACHE_ENTRIES", RESPONSE_CACHE_ENTRIES)))
@@ -0,0 +1,171 @@
+""" Contains a queue that runs scrapes in the background. """
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+SCRAPE_WORKERS = 2
+SCRAPE_INTERVAL = 900
+MAX_JOBS = 1000
+MAX_QUEUED = 100
+FINISHED = ('done', 'failed')
+
+
+class ScrapeError(Exception):
+    """ Raised by a scrape that found nothing to add, with the reason as its message. """
+
+
+class ScrapeQueueFull(Exception):
+    """ Raised when a scrape is submitted while max_queued jobs are still unfinished. """
+
+
+class ScrapeQueue():
+    """ Runs scrapes on a fixed pool of worker threads so they never hold up API
+        requests, and keeps the status and result of each as a job.
+
+        Jobs go from 'queued' to 'running' to 'done', or to 'failed' with a
+        message. Only the most recent max_jobs finished jobs are remembered, and
+        no more than max_queued jobs can be waiting or running at once.
+
+        Jobs live in the memory of the process that queued them, so with several
+        API processes a job can only be looked up on the one it was submitted to. """
+
+    def __init__(self, workers: int = SCRAPE_WORKERS, max_jobs: int = MAX_JOBS,
+                 max_queued: int = MAX_QUEUED):
+        self.max_jobs = max_jobs
+        self.max_queued = max_queued
+        self._unfinished = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scrape")
+        self._jobs = OrderedDict()
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, task, urls: list[str]) -> str:
+        """ Queues the task to scrape the urls and returns the new job's id.
+            The task returns a dict of counts to add to the job, or raises ScrapeError.
+            Raises ScrapeQueueFull if max_queued jobs are unfinished. """
+        job_id = uuid4().hex
+        with self._lock:
+            if self._unfinished >= self.max_queued:
+                raise ScrapeQueueFull(f"{self._unfinished} scrapes are already queued")
+            self._unfinished += 1
+            self._jobs[job_id] = {"id": job_id, "status": "queued", "urls": urls}
+            self._forget_finished()
+            self._futures[job_id] = self._pool.submit(self._run, job_id, task, urls)
+        return job_id
+
+    def _run(self, job_id: str, task, urls: list[str]) -> None:
+        """ Runs a job's task, recording its result or why it failed. """
+        self._update(job_id, status="running")
+        try:
+            result = task(urls)
+        except ScrapeError as err:
+            self._update(job_id, status="failed", message=str(err))
+        except Exception as err:  # pylint: disable=broad-except
+            self._update(job_id, status="failed", message=f"Scrape failed: {err}")
+        else:
+            self._update(job_id, status="done", **result)
+        finally:
+            with self._lock:
+                self._unfinished -= 1
+
+    def _update(self, job_id: str, **fields) -> None:
+        """ Changes the fields of a job if it is still remembered. """
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id] = self._jobs[job_id] | fields
+
+    def _forget_finished(self) -> None:
+        """ Drops the oldest finished jobs once there are more than max_jobs. """
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                return
+            if self._jobs[job_id]['status'] in FINISHED:
+                del self._jobs[job_id]
+                self._futures.pop(job_id, None)
+
+    def get(self, job_id: str) -> dict | None:
+        """ Returns the job with the given id, or None if there isn't one. """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: float = None) -> dict | None:
+        """ Waits for the job to finish and returns it. """
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future:
+            future.result(timeout)
+        return self.get(job_id)
+
+    def shutdown(self) -> None:
+        """ Stops taking jobs and waits for the queued ones to finish. """
+        self._pool.shutdown(wait=True)
+
+
+class ScrapeScheduler():
+    """ Queues a scrape of the feed urls every interval seconds on a background thread.
+
+        Each url's ETag, Last-Modified and content hash are kept between polls
+        and passed to the task as page_states, so pages that haven't changed
+        are neither downloaded again nor parsed. A poll is skipped while the
+        last one is still running or the queue is full. """
+
+    def __init__(self, queue: ScrapeQueue, task, urls: list[str],
+                 interval: float = SCRAPE_INTERVAL):
+        self.queue = queue
+        self.task = task
+        self.urls = urls
+        self.interval = interval
+        self.page_states = {url: {} for url in urls}
+        self._last_job_id = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def poll(self) -> str | None:
+        """ Queues a scrape of the feeds, returning its job id, unless the last is
+            unfinished or the queue is full. """
+        last_job = self.queue.get(self._last_job_id) if self._last_job_id else None
+        if last_job and last_job['status'] not in FINISHED:
+            return None
+        try:
+            self._last_job_id = self.queue.submit(
+                lambda urls: self.task(urls, page_states=self.page_states), self.urls)
+        except ScrapeQueueFull:
+            return None
+        return self._last_job_id
+
+    def _run(self) -> None:
+        """ Polls straight away and then after every interval until stopped. """
+        while not self._stopped.is_set():
+            self.poll()
+            self._stopped.wait(self.interval)
+
+    def start(self) -> None:
+        """ Starts polling on a background thread. """
+        self._thread = threading.Thread(target=self._run, daemon=True, name="scrape-scheduler")
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ Stops polling. """
+        self._stopped.set()
+
+
+def get_scrape_queue() -> ScrapeQueue:
+    """ Returns a scrape queue with the number of workers given by SCRAPE_WORKERS,
+        holding up to SCRAPE_MAX_QUEUED unfinished jobs. """
+    return ScrapeQueue(int(os.environ.get("SCRAPE_WORKERS", SCRAPE_WORKERS)),
+                       max_queued=int(os.environ.get("SCRAPE_MAX_QUEUED", MAX_QUEUED)))
+
+
+def get_scrape_scheduler(queue: ScrapeQueue, task) -> ScrapeScheduler | None:
+    """ Returns a started scheduler for the comma separated urls in SCRAPE_FEEDS,
+        polled every SCRAPE_INTERVAL seconds, or None if no feeds are set. """
+    urls = [url.strip() for url in os.environ.get("SCRAPE_FEEDS", "").split(",") if url.strip()]
+    if not urls:
+        return None
+    scheduler = ScrapeScheduler(queue, task, urls,
+                                float(os.environ.get("SCRAPE_INTERVAL", SCRAPE_INTERVAL)))
+    scheduler.start()
+    return scheduler
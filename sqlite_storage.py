@@ -0,0 +1,351 @@
+""" Contains an SQLite store for the stories, used in place of stories.json. """
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from storage import (ABS_PATH, STORIES_PATH, TOMBSTONE_MAX_AGE, ScoreBelowZero, load_from_file,
+                     normalize_url, parse_timestamp, timestamp_now)
+
+SQLITE_PATH = os.path.join(ABS_PATH, "stories.db")
+
+SORT_COLUMNS = {'title': 'upper(title)', 'score': 'score',
+                'created': 'created_ts', 'modified': 'updated_ts'}
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS stories (
+           id INTEGER PRIMARY KEY,
+           title TEXT NOT NULL,
+           url TEXT NOT NULL,
+           url_key TEXT NOT NULL,
+           website TEXT NOT NULL,
+           score INTEGER NOT NULL DEFAULT 0 CHECK (score >= 0),
+           created_at TEXT NOT NULL,
+           created_ts INTEGER NOT NULL,
+           updated_at TEXT NOT NULL,
+           updated_ts INTEGER NOT NULL)""",
+    "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    """CREATE TABLE IF NOT EXISTS tombstones (
+           id INTEGER PRIMARY KEY,
+           deleted_at TEXT NOT NULL,
+           deleted_ts INTEGER NOT NULL)""",
+    "INSERT OR IGNORE INTO metadata (key, value) VALUES ('next_id', 0)",
+    "INSERT OR IGNORE INTO metadata (key, value) VALUES ('version', 0)",
+    "INSERT OR IGNORE INTO metadata (key, value) VALUES ('modified_at', 0)",
+    "CREATE INDEX IF NOT EXISTS stories_url_key_idx ON stories (url_key)",
+    "CREATE INDEX IF NOT EXISTS stories_score_idx ON stories (score, id)",
+    "CREATE INDEX IF NOT EXISTS stories_created_idx ON stories (created_ts, id)",
+    "CREATE INDEX IF NOT EXISTS stories_updated_idx ON stories (updated_ts, id)",
+    "CREATE INDEX IF NOT EXISTS stories_title_idx ON stories (upper(title), id)",
+    "CREATE INDEX IF NOT EXISTS tombstones_deleted_idx ON tombstones (deleted_ts, id)",
+]
+
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(
+           title, content='stories', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS stories_fts_insert AFTER INSERT ON stories BEGIN
+           INSERT INTO stories_fts (rowid, title) VALUES (new.id, new.title);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS stories_fts_delete AFTER DELETE ON stories BEGIN
+           INSERT INTO stories_fts (stories_fts, rowid, title) VALUES ('delete', old.id, old.title);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS stories_fts_update AFTER UPDATE OF title ON stories BEGIN
+           INSERT INTO stories_fts (stories_fts, rowid, title) VALUES ('delete', old.id, old.title);
+           INSERT INTO stories_fts (rowid, title) VALUES (new.id, new.title);
+       END""",
+]
+
+COLUMNS = "id, title, url, website, score, created_at, updated_at"
+
+INSERT_STORY = """INSERT INTO stories
+    (id, title, url, url_key, website, score, created_at, created_ts, updated_at, updated_ts)
+    VALUES (:id, :title, :url, :url_key, :website, :score,
+            :created_at, :created_ts, :updated_at, :updated_ts)"""
+
+BUMP_VERSION = """UPDATE metadata SET value = CASE key WHEN 'version' THEN value + 1 ELSE ? END
+    WHERE key IN ('version', 'modified_at')"""
+
+SYNC_NEXT_ID = """UPDATE metadata SET value = MAX(value, (SELECT COALESCE(MAX(id) + 1, 0) FROM stories))
+    WHERE key = 'next_id'"""
+
+
+def to_row(story: dict) -> dict:
+    """ Returns the column values for a story. """
+    return {**story, "url_key": normalize_url(story['url']),
+            "created_ts": parse_timestamp(story['created_at']),
+            "updated_ts": parse_timestamp(story['updated_at'])}
+
+
+def to_story(row: sqlite3.Row) -> dict:
+    """ Returns the story for a row, in the same form as stories.json. """
+    return {"created_at": row['created_at'],
+            "id": row['id'],
+            "score": row['score'],
+            "title": row['title'],
+            "updated_at": row['updated_at'],
+            "url": row['url'],
+            "website": row['website']}
+
+
+def like_pattern(search_term: str) -> str:
+    """ Returns a LIKE pattern matching titles that contain the search term. """
+    escaped = search_term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class SQLiteStore():
+    """ Keeps the stories in an SQLite database, with the same methods as StoryStore,
+        for single server deployments.
+
+        The database runs in WAL mode, so readers never block the writer, and a
+        vote is a single row update rather than a rewrite of every story. Titles
+        are searched through an FTS5 trigram index, which matches part of a word
+        like the other stores do. Each thread has its own connection, closed
+        when the thread ends, and sqlite3 reuses the prepared statements of
+        each connection. """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        connection = self._connection()
+        for statement in SCHEMA:
+            connection.execute(statement)
+        try:
+            for statement in FTS_SCHEMA:
+                connection.execute(statement)
+            self._fts = True
+        except sqlite3.OperationalError:
+            # FTS5 or its trigram tokenizer is missing from this SQLite build.
+            self._fts = False
+        connection.execute(SYNC_NEXT_ID)
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Returns this thread's connection, opening it the first time. """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.depth = 0
+            self._local.scores = {}
+            with self._connections_lock:
+                self._connections.append(connection)
+            # A server thread per request would otherwise leave a file open per request.
+            weakref.finalize(threading.current_thread(), self._forget_connection,
+                             self._connections, self._connections_lock, connection)
+        return connection
+
+    @staticmethod
+    def _forget_connection(connections: list, lock: threading.Lock,
+                           connection: sqlite3.Connection) -> None:
+        """ Closes the connection of a thread that has ended. """
+        with lock:
+            if connection in connections:
+                connections.remove(connection)
+        connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """ Holds the database's write lock while everything inside it runs, then commits.
+            Transactions on the same thread can be nested. """
+        connection = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        self._local.scores = {}
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+
+    def close(self) -> None:
+        """ Closes every thread's connection. """
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def load(self) -> list[dict]:
+        """ Returns all of the stories in the order they were added. """
+        return self.list_stories()
+
+    def get(self, s_id: int) -> dict | None:
+        """ Returns the story with the given id, or None if there isn't one. """
+        row = self._connection().execute(
+            f"SELECT {COLUMNS} FROM stories WHERE id = ?", (s_id,)).fetchone()
+        if not row:
+            return None
+        if self._local.depth:
+            self._local.scores[s_id] = row['score']
+        return to_story(row)
+
+    def count(self) -> int:
+        """ Returns the number of stories. """
+        return self._connection().execute("SELECT count(*) FROM stories").fetchone()[0]
+
+    def has_url(self, url: str) -> bool:
+        """ Returns whether there is already a story for the url, once normalized. """
+        return self._connection().execute(
+            "SELECT 1 FROM stories WHERE url_key = ? LIMIT 1",
+            (normalize_url(url),)).fetchone() is not None
+
+    def next_id(self) -> int:
+        """ Hands out the id for a new story from a counter that never goes back,
+            so ids are never reused. """
+        with self.transaction():
+            connection = self._connection()
+            new_id = connection.execute(
+                "SELECT value FROM metadata WHERE key = 'next_id'").fetchone()[0]
+            connection.execute("UPDATE metadata SET value = ? WHERE key = 'next_id'",
+                               (new_id + 1,))
+            return new_id
+
+    def version(self) -> tuple[str, float]:
+        """ Returns a counter that goes up with every change to the stories,
+            and the time of the last change. """
+        rows = dict(self._connection().execute(
+            "SELECT key, value FROM metadata WHERE key IN ('version', 'modified_at')").fetchall())
+        return str(rows['version']), rows['modified_at']
+
+    def changes(self, since: int) -> tuple[list[dict], list[dict]]:
+        """ Returns the stories updated at or after since, in seconds since the epoch,
+            in order of their update, and the tombstones of those deleted since then. """
+        connection = self._connection()
+        rows = connection.execute(
+            f"SELECT {COLUMNS} FROM stories WHERE updated_ts >= ? ORDER BY updated_ts, id",
+            (since,)).fetchall()
+        tombstones = connection.execute(
+            "SELECT id, deleted_at FROM tombstones WHERE deleted_ts >= ? ORDER BY deleted_ts, id",
+            (since,)).fetchall()
+        return [to_story(row) for row in rows], [dict(row) for row in tombstones]
+
+    @staticmethod
+    def _order_by(sort_param: str, descending: bool) -> str:
+        """ Returns the ORDER BY clause for the sort property, with ties in id order. """
+        direction = "DESC" if descending else "ASC"
+        if not sort_param:
+            return "ORDER BY id"
+        return f"ORDER BY {SORT_COLUMNS[sort_param]} {direction}, id {direction}"
+
+    def list_stories(self, sort_param: str = None, descending: bool = False,
+                     start: int = 0, stop: int = None) -> list[dict]:
+        """ Returns the stories between the start and stop positions, in order of the
+            sort property, or in the order they were added. """
+        limit = -1 if stop is None else max(stop - start, 0)
+        rows = self._connection().execute(
+            f"SELECT {COLUMNS} FROM stories {self._order_by(sort_param, descending)} "
+            "LIMIT ? OFFSET ?", (limit, start)).fetchall()
+        return [to_story(row) for row in rows]
+
+    def _title_filter(self, search_term: str) -> tuple[str, str]:
+        """ Returns the WHERE clause and its parameter for titles containing the term.
+            Terms of three or more characters are answered by the FTS5 index. """
+        if self._fts and len(search_term) >= 3:
+            return ("id IN (SELECT rowid FROM stories_fts WHERE stories_fts MATCH ?)",
+                    '"' + search_term.replace('"', '""') + '"')
+        return "title LIKE ? ESCAPE '\\'", like_pattern(search_term)
+
+    def search(self, search_term: str, sort_param: str = None, descending: bool = False,
+               start: int = 0, stop: int = None) -> tuple[list[dict], int]:
+        """ Returns the stories between the start and stop positions that have the
+            search term in their title, ignoring case, along with the number found. """
+        limit = -1 if stop is None else max(stop - start, 0)
+        where, term = self._title_filter(search_term)
+        connection = self._connection()
+        rows = connection.execute(
+            f"SELECT {COLUMNS} FROM stories WHERE {where} "
+            f"{self._order_by(sort_param, descending)} LIMIT ? OFFSET ?",
+            (term, limit, start)).fetchall()
+        total = connection.execute(
+            f"SELECT count(*) FROM stories WHERE {where}", (term,)).fetchone()[0]
+        return [to_story(row) for row in rows], total
+
+    def save(self, stories: list[dict]) -> None:
+        """ Replaces all of the stories in the database with the given stories. """
+        with self.transaction():
+            connection = self._connection()
+            connection.execute("DELETE FROM stories")
+            connection.executemany(INSERT_STORY, [to_row(story) for story in stories])
+            connection.execute(SYNC_NEXT_ID)
+            connection.execute(BUMP_VERSION, (int(time.time()),))
+
+    def commit(self, op: str, *stories: dict) -> None:
+        """ Writes a 'create', 'vote', 'update' or 'delete' of the stories to the database,
+            leaving a tombstone for each deleted story. A vote on a story read in the
+            same transaction is written as the change in its score. """
+        with self.transaction():
+            connection = self._connection()
+            connection.execute(BUMP_VERSION, (int(time.time()),))
+            if op == 'delete':
+                deleted_at = timestamp_now()
+                connection.execute("DELETE FROM tombstones WHERE deleted_ts < ?",
+                                   (parse_timestamp(deleted_at) - TOMBSTONE_MAX_AGE,))
+            for story in stories:
+                if op == 'create':
+                    connection.execute(INSERT_STORY, to_row(story))
+                elif op == 'delete':
+                    connection.execute("DELETE FROM stories WHERE id = ?", (story['id'],))
+                    connection.execute(
+                        "INSERT OR REPLACE INTO tombstones (id, deleted_at, deleted_ts) "
+                        "VALUES (?, ?, ?)", (story['id'], deleted_at, parse_timestamp(deleted_at)))
+                elif op == 'update':
+                    connection.execute(
+                        """UPDATE stories SET title = :title, url = :url, url_key = :url_key,
+                           website = :website, updated_at = :updated_at,
+                           updated_ts = :updated_ts WHERE id = :id""", to_row(story))
+                else:
+                    row = to_row(story)
+                    if story['id'] in self._local.scores:
+                        row['delta'] = story['score'] - self._local.scores.pop(story['id'])
+                        cursor = connection.execute(
+                            """UPDATE stories SET score = score + :delta, updated_at = :updated_at,
+                               updated_ts = :updated_ts WHERE id = :id AND score + :delta >= 0""",
+                            row)
+                        if cursor.rowcount == 0:
+                            raise ScoreBelowZero(f"Story {story['id']} can't go below 0 votes")
+                    else:
+                        connection.execute(
+                            """UPDATE stories SET score = :score, updated_at = :updated_at,
+                               updated_ts = :updated_ts WHERE id = :id""", row)
+
+
+def migrate_from_json(json_path: str = STORIES_PATH, db_path: str = SQLITE_PATH) -> int:
+    """ Copies the stories from a stories.json file into an SQLite database,
+        replacing any stories already in it. Returns the number of stories copied. """
+    stories = load_from_file(json_path)
+    store = SQLiteStore(db_path)
+    try:
+        store.save(stories)
+    finally:
+        store.close()
+    return len(stories)
+
+
+if __name__ == "__main__":
+    # Usage: python sqlite_storage.py migrate [stories.json] [stories.db]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        sys.exit("Usage: python sqlite_storage.py migrate [stories.json] [stories.db]")
+    source = sys.argv[2] if len(sys.argv) > 2 else STORIES_PATH
+    target = sys.argv[3] if len(sys.argv) > 3 else SQLITE_PATH
+    copied = migrate_from_json(source, target)
+    print(f"Copied {copied} stories from {source} to {target}")
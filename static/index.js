@@ -2,9 +2,12 @@ function getUrl() {
   return window.location.href
 }
 
+const shownStories = new Map()
+
 function resetStories() {
   const stories = document.getElementById('stories')
   stories.innerHTML = ''
+  shownStories.clear()
 }
 
 function createVoteButton(id, text) {
@@ -60,14 +63,22 @@ async function handleEdit(id, url, title) {
     alert(data.message)
   }
 
-  getStories()
+  // The stream only carries changes made by the process it is connected to,
+  // so the row is patched from the response too.
+  if (data.story) {
+    placeStory(data.story)
+  }
 }
 
-async function getStories() {
+const PAGE_SIZE = 20
+let nextOffset = null
+let loadingStories = false
+
+async function fetchStories(offset) {
   const searchTerm = document.getElementById('search_input').value
   const sort = document.getElementById('sort').value
   const order = document.getElementById('order').value
-  let url = `${getUrl()}/stories?sort=${sort}&order=${order}`
+  let url = `${getUrl()}/stories?sort=${sort}&order=${order}&limit=${PAGE_SIZE}&offset=${offset}`
 
   if (searchTerm) {
     url += `&search=${searchTerm}`
@@ -93,8 +104,36 @@ async function getStories() {
     alert(data.message)
   }
 
+  return data
+}
+
+function displayPage(data) {
+  if (data.stories) {
+    displayStories(data.stories)
+    nextOffset = data.next_offset
+  } else {
+    nextOffset = null
+  }
+}
+
+async function getStories() {
+  const data = await fetchStories(0)
+
   resetStories()
-  displayStories(data)
+  displayPage(data)
+}
+
+async function getMoreStories() {
+  if (nextOffset === null || loadingStories) {
+    return
+  }
+
+  loadingStories = true
+  try {
+    displayPage(await fetchStories(nextOffset))
+  } finally {
+    loadingStories = false
+  }
 }
 
 function onError(response) {
@@ -125,7 +164,9 @@ async function handleVote(e) {
     alert(data.message)
   }
 
-  getStories()
+  if (data.story) {
+    placeStory(data.story)
+  }
 }
 
 async function handleDelete(e) {
@@ -153,7 +194,9 @@ async function handleDelete(e) {
     alert(data.message)
   }
 
-  getStories()
+  if (rawRes.ok) {
+    removeStory(Number(id))
+  }
 }
 
 function getContentComponent(story) {
@@ -187,18 +230,136 @@ function getVotesComponent(story) {
   return voteWrapper
 }
 
-function createStory(story) {
-  const stories = document.getElementById('stories')
+function getStoryComponent(story) {
   const storyWrapper = document.createElement('div')
   storyWrapper.classList = 'storyWrapper'
+  storyWrapper.dataset.id = story.id
 
   const contentWrapper = getContentComponent(story)
   const voteWrapper = getVotesComponent(story)
 
   storyWrapper.append(voteWrapper, contentWrapper)
+  return storyWrapper
+}
+
+function createStory(story) {
+  if (shownStories.has(story.id)) {
+    // Already shown, as the pages have shifted since it was loaded.
+    return
+  }
+
+  const stories = document.getElementById('stories')
+  const storyWrapper = getStoryComponent(story)
+
+  shownStories.set(story.id, { story, element: storyWrapper })
   stories.append(storyWrapper)
 }
 
+function sortKey(story, sort) {
+  if (sort === 'title') {
+    return story.title.toUpperCase()
+  }
+  if (sort === 'score') {
+    return story.score
+  }
+  if (sort === 'created') {
+    return Date.parse(story.created_at)
+  }
+  return Date.parse(story.updated_at)
+}
+
+function compareStories(a, b) {
+  const sort = document.getElementById('sort').value
+  const order = document.getElementById('order').value
+  const keyA = sortKey(a, sort)
+  const keyB = sortKey(b, sort)
+  let result = 0
+
+  if (keyA !== keyB) {
+    result = keyA < keyB ? -1 : 1
+  }
+
+  return order === 'descending' ? -result : result
+}
+
+function matchesSearch(story) {
+  const searchTerm = document.getElementById('search_input').value
+  return story.title.toLowerCase().includes(searchTerm.toLowerCase())
+}
+
+function removeStory(id) {
+  const shown = shownStories.get(id)
+
+  if (shown) {
+    shown.element.remove()
+    shownStories.delete(id)
+    if (nextOffset !== null) {
+      nextOffset -= 1
+    }
+  }
+}
+
+function placeStory(story) {
+  removeStory(story.id)
+
+  if (!matchesSearch(story)) {
+    return
+  }
+
+  const stories = document.getElementById('stories')
+  const next = [...stories.children].find(
+    (element) =>
+      compareStories(story, shownStories.get(Number(element.dataset.id)).story) < 0
+  )
+
+  if (!next && nextOffset !== null) {
+    // The story belongs on a page that hasn't been loaded yet.
+    return
+  }
+
+  const storyWrapper = getStoryComponent(story)
+  shownStories.set(story.id, { story, element: storyWrapper })
+  stories.insertBefore(storyWrapper, next || null)
+  if (nextOffset !== null) {
+    nextOffset += 1
+  }
+}
+
+function applyVotes(votes) {
+  votes.forEach((vote) => {
+    const shown = shownStories.get(vote.id)
+
+    if (shown) {
+      placeStory({ ...shown.story, ...vote })
+    }
+  })
+}
+
+function setupStream() {
+  let opened = false
+
+  const storyStream = new EventSource(`${getUrl()}/stories/stream`)
+  storyStream.onopen = () => {
+    // Changes made while reconnecting were missed, so the list is reloaded.
+    if (opened) {
+      getStories()
+    }
+    opened = true
+  }
+  storyStream.addEventListener('create', (e) => {
+    JSON.parse(e.data).forEach(placeStory)
+  })
+  storyStream.addEventListener('update', (e) => {
+    JSON.parse(e.data).forEach(placeStory)
+  })
+  storyStream.addEventListener('vote', (e) => {
+    applyVotes(JSON.parse(e.data))
+  })
+  storyStream.addEventListener('delete', (e) => {
+    JSON.parse(e.data).forEach((story) => removeStory(story.id))
+  })
+}
+
 function displayStories(stories) {
   stories.forEach(createStory)
 }
@@ -223,8 +384,21 @@ function setupSearch() {
   }
 }
 
+function setupScroll() {
+  window.onscroll = () => {
+    const distanceToBottom =
+      document.body.offsetHeight - (window.innerHeight + window.scrollY)
+
+    if (distanceToBottom < 300) {
+      getMoreStories()
+    }
+  }
+}
+
 window.onload = async function load() {
   getStories()
+  setupStream()
   setupSelects()
   setupSearch()
+  setupScroll()
 }
@@ -4,6 +4,17 @@ function onError(response) {
   )
 }
 
+async function waitForJob(location) {
+  for (;;) {
+    const response = await fetch(location)
+    const job = await response.json()
+    if (job.error || job.status === 'done' || job.status === 'failed') {
+      return job
+    }
+    await new Promise((resolve) => setTimeout(resolve, 500))
+  }
+}
+
 window.onload = async function load() {
   const submitComponent = document.getElementById('submit_scrape')
 
@@ -20,7 +31,7 @@ window.onload = async function load() {
       }
     })
 
-    if (response.status !== 200) {
+    if (response.status !== 202) {
       onError(response)
     }
 
@@ -28,8 +39,15 @@ window.onload = async function load() {
 
     if (data.error) {
       alert(data.message)
-    } else {
+      return
+    }
+
+    const job = await waitForJob(response.headers.get('Location'))
+
+    if (job.status === 'done') {
       window.location.href = '/'
+    } else {
+      alert(job.message)
     }
   }
 }
@@ -2,17 +2,640 @@
 
 import os
 import json
+import time
+import atexit
+import hashlib
+import calendar
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from indexes import SearchIndex, SortedIndex
+from json_codec import decode, encode
+from threading import RLock, Thread, Timer
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 ABS_PATH = os.path.dirname(os.path.abspath(__file__))
+STORIES_PATH = os.path.join(ABS_PATH, "stories.json")
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+VOTE_FLUSH_COUNT = 100
+TOMBSTONE_MAX_AGE = 30 * 24 * 60 * 60
+SORT_PARAMS = ('title', 'score', 'created', 'modified')
+TIME_FORMAT = "%a, %d %b %Y %H:%M:%S GMT"
+MONTHS = {month: number for number, month in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], 1)}
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'at_medium', 'at_campaign')
 
-def save_to_file(data: list[dict]) -> None:
-    """ Save the data to a file called stories.json. """
-    with open(os.path.join(ABS_PATH, "stories.json"), mode="w", encoding="UTF-8") as f:
-        json.dump(data, f, indent=3)
 
+class ScoreBelowZero(Exception):
+    """ Raised by a store's commit when a vote would take a story's score below 0,
+        because the score changed after the story was read. """
 
-def load_from_file() -> list[dict]:
+
+def write_temp_file(data: bytes, path: str) -> str:
+    """ Writes the data to a temporary file next to the given path and
+        flushes it to disk, returning the temporary file's path. """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                     prefix=".stories-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode="wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def replace_file(temp_path: str, path: str) -> None:
+    """ Atomically renames the temporary file over the given path. """
+    os.replace(temp_path, path)
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(os.path.dirname(path), os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def parse_timestamp(stamp: str) -> int:
+    """ Converts a timestamp in TIME_FORMAT to seconds since the epoch.
+        Splitting the fixed format by hand is many times faster than strptime. """
+    _, day, month, year, clock, _ = stamp.split(" ")
+    hour, minute, second = clock.split(":")
+    return calendar.timegm((int(year), MONTHS[month], int(day),
+                            int(hour), int(minute), int(second)))
+
+
+def format_timestamp(seconds: int) -> str:
+    """ Converts seconds since the epoch back to a timestamp in TIME_FORMAT. """
+    return time.strftime(TIME_FORMAT, time.gmtime(seconds))
+
+
+def timestamp_now() -> str:
+    """ Returns the current time in TIME_FORMAT, stamped the same way as stories. """
+    return datetime.now().strftime(TIME_FORMAT)
+
+
+def normalize_url(url: str) -> str:
+    """ Returns the form of a url used to spot duplicate stories, ignoring the scheme,
+        case of the host, a leading www., a trailing slash, the fragment and tracking parameters. """
+    parts = urlsplit(url.strip())
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith(TRACKING_PARAMS))
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    normalized = host + parts.path.rstrip("/")
+    if query:
+        normalized += "?" + urlencode(query)
+    return normalized
+
+
+def save_to_file(data: list[dict], path: str = STORIES_PATH, pretty: bool = False) -> None:
+    """ Save the data to a file called stories.json, as compact JSON unless pretty is set.
+        Readers and crashes only ever see the old file or the new one. """
+    replace_file(write_temp_file(encode(data, pretty), path), path)
+
+
+def load_from_file(path: str = STORIES_PATH) -> list[dict]:
     """ Load the stories from a file called stories.json. """
-    with open(os.path.join(ABS_PATH, "stories.json"), encoding="UTF-8") as file:
-        data = json.load(file)
-        return data
+    with open(path, mode="rb") as file:
+        return decode(file.read())
+
+
+def save_metadata(metadata: dict, path: str) -> None:
+    """ Save the store's metadata, such as the next story id, next to the stories. """
+    replace_file(write_temp_file(encode(metadata), path), path)
+
+
+def load_metadata(path: str) -> dict:
+    """ Load the store's metadata, or an empty dict if none has been saved yet. """
+    if not os.path.exists(path):
+        return {}
+    with open(path, mode="rb") as file:
+        return decode(file.read())
+
+
+def append_to_journal(records: list[dict], path: str) -> None:
+    """ Appends each record to the journal as a line of JSON. If a crash left the
+        last line unfinished, the records start on a new line so they can still be read. """
+    lines = b"".join(encode(record) + b"\n" for record in records)
+    with open(path, mode="a+b") as f:
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                lines = b"\n" + lines
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_from_journal(path: str) -> list[dict]:
+    """ Loads the records from a journal, skipping a line left unfinished by a crash. """
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, mode="rb") as file:
+        for line in file:
+            try:
+                records.append(decode(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def replay_journal(stories_by_id: dict[int, dict], records: list[dict]) -> int:
+    """ Applies the journal records in order on top of the snapshot stories.
+        Returns the highest story id found in the records, or -1 if there are none. """
+    highest_id = -1
+    for record in records:
+        if record['op'] == 'delete':
+            stories_by_id.pop(record['id'], None)
+        else:
+            stories_by_id[record['story']['id']] = record['story']
+            highest_id = max(highest_id, record['story']['id'])
+    return highest_id
+
+
+def file_signature(path: str) -> tuple | None:
+    """ Returns the inode, modification time and size of a file, or None if it is missing. """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class StoryStore():
+    """ Keeps the stories in memory so they are only parsed once,
+        reloading them when the file is changed by someone else.
+
+        In journal mode each change is appended to a journal next to the
+        stories file instead of rewriting it, and the journal is folded back
+        into the stories file in the background once it grows too large.
+
+        Changes must be made inside transaction(), which serializes writers
+        across threads and, through a lock file, across processes. Readers
+        only wait for the in-memory stories to be changed or re-read, never
+        for the lock file or for a write to reach the disk.
+
+        Stories are held in a dict keyed by id, so finding, adding and
+        removing a story never has to scan the whole list. An index of
+        normalized urls lets duplicates be spotted without a scan, and each
+        story's timestamps are kept parsed. Titles are held in a search index,
+        and a sorted index for each sort
+        property is kept up to date, so listing stories in order never has
+        to sort them. New ids come from
+        a counter saved in a metadata file, so an id is never handed out twice
+        even after its story is deleted. The metadata file also keeps a
+        tombstone for each story deleted within TOMBSTONE_MAX_AGE seconds, so
+        changes() can report deletions.
+
+        When vote_flush_ms is set, votes change the stories in memory straight
+        away but are only written every vote_flush_ms milliseconds or every
+        vote_flush_count votes, and when the process exits. Until then each
+        story's summed score change is kept, and re-applied if the file is
+        reloaded, so votes from other processes are never overwritten.
+
+        The stories file is written as compact JSON, or indented when pretty is set. """
+
+    def __init__(self, path: str = STORIES_PATH, journal: bool = False,
+                 compact_bytes: int = JOURNAL_COMPACT_BYTES, vote_flush_ms: int = 0,
+                 vote_flush_count: int = VOTE_FLUSH_COUNT, pretty: bool = False):
+        self.path = path
+        self.journal = journal
+        self.pretty = pretty
+        self.compact_bytes = compact_bytes
+        self.vote_flush_ms = vote_flush_ms
+        self.vote_flush_count = vote_flush_count
+        self.journal_path = os.path.splitext(path)[0] + ".journal"
+        self.compacting_path = self.journal_path + ".compacting"
+        self.lock_path = os.path.splitext(path)[0] + ".lock"
+        self.metadata_path = os.path.splitext(path)[0] + ".meta.json"
+        self._stories = {}
+        self._ids_by_url = {}
+        self._url_by_id = {}
+        self._timestamps = {}
+        self._sort_indexes = {sort_param: SortedIndex() for sort_param in SORT_PARAMS}
+        self._search_index = SearchIndex()
+        self._next_id = 0
+        self._tombstones = []
+        self._saved_metadata = {}
+        self._listing = []
+        self._signature = None
+        self._lock = RLock()
+        self._write_lock = RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+        self._compactor = None
+        self._pending_votes = {}
+        self._buffered_votes = 0
+        self._flush_timer = None
+        self._votes_modified = 0
+        if vote_flush_ms:
+            atexit.register(self.flush)
+
+    def _file_signature(self) -> tuple:
+        """ Returns the signatures of the stories file, its journals and its metadata. """
+        return (file_signature(self.path), file_signature(self.compacting_path),
+                file_signature(self.journal_path), file_signature(self.metadata_path))
+
+    def _read(self) -> None:
+        """ Reads the stories file and replays any journal records on top of it. """
+        stories = load_from_file(self.path) if os.path.exists(self.path) else []
+        self._stories = {story['id']: story for story in stories}
+        highest_id = replay_journal(self._stories, load_from_journal(self.compacting_path)
+                                    + load_from_journal(self.journal_path))
+        highest_id = max([highest_id, *self._stories])
+        self._reapply_votes()
+        self._rebuild_indexes()
+        metadata = load_metadata(self.metadata_path)
+        self._tombstones = metadata.get('tombstones', [])
+        self._saved_metadata = {"next_id": metadata.get('next_id', 0),
+                                "tombstones": self._tombstones}
+        self._next_id = max(self._saved_metadata['next_id'], highest_id + 1)
+
+    def _reapply_votes(self) -> None:
+        """ Applies the buffered votes again on top of freshly read stories,
+            dropping those for stories that have since been deleted. """
+        for s_id, (delta, updated_at) in list(self._pending_votes.items()):
+            story = self._stories.get(s_id)
+            if story is None:
+                del self._pending_votes[s_id]
+                continue
+            story['score'] = max(story['score'] + delta, 0)
+            story['updated_at'] = updated_at
+
+    def _rebuild_indexes(self) -> None:
+        """ Builds the indexes from scratch for the stories held in memory. """
+        self._ids_by_url = {}
+        self._url_by_id = {}
+        self._timestamps = {}
+        self._search_index = SearchIndex()
+        for story in self._stories.values():
+            self._index_fields(story)
+        for sort_param, index in self._sort_indexes.items():
+            key = self._sort_key(sort_param)
+            index.build({s_id: key(story) for s_id, story in self._stories.items()})
+
+    def _index(self, story: dict) -> None:
+        """ Adds a new or changed story to the indexes. """
+        self._index_fields(story)
+        for sort_param, index in self._sort_indexes.items():
+            index.add(story['id'], self._sort_key(sort_param)(story))
+
+    def _index_fields(self, story: dict) -> None:
+        """ Indexes the story's normalized url, parsed timestamps and title. """
+        url = normalize_url(story['url'])
+        if self._url_by_id.get(story['id']) != url:
+            self._unindex_url(story['id'])
+            self._ids_by_url.setdefault(url, set()).add(story['id'])
+            self._url_by_id[story['id']] = url
+        self._timestamps[story['id']] = (parse_timestamp(story['created_at']),
+                                         parse_timestamp(story['updated_at']))
+        self._search_index.add(story['id'], story['title'])
+
+    def _unindex(self, story: dict) -> None:
+        """ Removes a story from the indexes. """
+        self._unindex_url(story['id'])
+        self._timestamps.pop(story['id'], None)
+        self._search_index.remove(story['id'])
+        for index in self._sort_indexes.values():
+            index.remove(story['id'])
+
+    def _unindex_url(self, s_id: int) -> None:
+        """ Removes a story from the url index, using the url it was indexed under. """
+        url = self._url_by_id.pop(s_id, None)
+        if url is not None:
+            self._ids_by_url[url].discard(s_id)
+            if not self._ids_by_url[url]:
+                del self._ids_by_url[url]
+
+    def _refresh(self) -> None:
+        """ Re-reads the files if they have changed since they were last read or written.
+            Nothing else can change them while this process holds the file lock. """
+        if self._lock_depth:
+            return
+        signature = self._file_signature()
+        if signature != self._signature:
+            self._read()
+            self._listing = None
+            self._signature = signature
+
+    def load(self) -> list[dict]:
+        """ Returns the stories held in memory, re-reading the files only if they have changed. """
+        with self._lock:
+            self._refresh()
+            if self._listing is None:
+                self._listing = list(self._stories.values())
+            return self._listing
+
+    def get(self, s_id: int) -> dict | None:
+        """ Returns the story with the given id, or None if there isn't one. """
+        with self._lock:
+            self._refresh()
+            return self._stories.get(s_id)
+
+    def count(self) -> int:
+        """ Returns the number of stories. """
+        with self._lock:
+            self._refresh()
+            return len(self._stories)
+
+    def search(self, search_term: str, sort_param: str = None, descending: bool = False,
+               start: int = 0, stop: int = None) -> tuple[list[dict], int]:
+        """ Returns the stories between the start and stop positions that have the
+            search term in their title, ignoring case, along with the number found.
+            They are in the order they were added unless a sort property is given, with
+            ties ordered by id in the same direction, as list_stories orders them. """
+        with self._lock:
+            self._refresh()
+            found_stories = [self._stories[s_id]
+                             for s_id in self._search_index.search(search_term)]
+            if sort_param:
+                key = self._sort_key(sort_param)
+                found_stories.sort(key=lambda story: (key(story), story['id']),
+                                   reverse=descending)
+            return found_stories[start:stop], len(found_stories)
+
+    def _sort_key(self, sort_param: str):
+        """ Returns the key function for sorting stories by the given property,
+            using the already parsed timestamps for 'created' and 'modified'. """
+        if sort_param == 'created':
+            return lambda story: self._timestamps[story['id']][0]
+        if sort_param == 'modified':
+            return lambda story: self._timestamps[story['id']][1]
+        if sort_param == 'title':
+            return lambda story: story['title'].upper()
+        return lambda story: story['score']
+
+    def list_stories(self, sort_param: str = None, descending: bool = False,
+                     start: int = 0, stop: int = None) -> list[dict]:
+        """ Returns the stories between the start and stop positions, in order of the
+            sort property read from its index, or in the order they were added. """
+        with self._lock:
+            if not sort_param:
+                return self.load()[start:stop]
+            self._refresh()
+            ids = self._sort_indexes[sort_param].ids(descending, start, stop)
+            return [self._stories[s_id] for s_id in ids]
+
+    def version(self) -> tuple[str, float]:
+        """ Returns a tag that changes whenever the stories do, and the time of the last
+            change. The tag comes from the files' signatures and any buffered votes, so
+            every process seeing the same stories gives the same tag. """
+        with self._lock:
+            self._refresh()
+            state = repr((self._signature, sorted(self._pending_votes.items())))
+            mtimes = [signature[1] / 1e9 for signature in self._signature if signature]
+            if self._pending_votes:
+                mtimes.append(self._votes_modified)
+            return hashlib.sha1(state.encode()).hexdigest(), max(mtimes, default=0)
+
+    def changes(self, since: int) -> tuple[list[dict], list[dict]]:
+        """ Returns the stories updated at or after since, in seconds since the epoch,
+            in order of their update, and the tombstones of those deleted since then. """
+        with self._lock:
+            self._refresh()
+            ids = self._sort_indexes['modified'].ids_from(since)
+            return ([self._stories[s_id] for s_id in ids],
+                    [tombstone for tombstone in self._tombstones
+                     if parse_timestamp(tombstone['deleted_at']) >= since])
+
+    def has_url(self, url: str) -> bool:
+        """ Returns whether there is already a story for the url, once normalized. """
+        with self._lock:
+            self._refresh()
+            return normalize_url(url) in self._ids_by_url
+
+    @contextmanager
+    def transaction(self):
+        """ Holds the write lock, with the stories brought up to date, while they
+            are changed and committed. Transactions on the same thread can be nested.
+            If an exception escapes, changes that weren't committed are thrown away. """
+        with self._write_lock:
+            if self._lock_depth == 0 and fcntl:
+                self._lock_file = open(self.lock_path, mode="a", encoding="UTF-8")
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                if self._lock_depth == 0:
+                    with self._lock:
+                        self._refresh()
+                self._lock_depth += 1
+                try:
+                    yield
+                except BaseException:
+                    # Routes change the stories in memory before committing them, so a
+                    # failed transaction is undone by reading the files again.
+                    self._signature = None
+                    raise
+                finally:
+                    self._lock_depth -= 1
+            finally:
+                if self._lock_depth == 0 and self._lock_file:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _save_metadata(self) -> None:
+        """ Saves the next id and the tombstones if they have changed since they were last
+            saved. They are always saved before the stories, so a crash can skip ids but
+            never reuse them. """
+        metadata = {"next_id": self._next_id, "tombstones": self._tombstones}
+        if metadata != self._saved_metadata:
+            save_metadata(metadata, self.metadata_path)
+            self._saved_metadata = metadata
+
+    def next_id(self) -> int:
+        """ Hands out the id for a new story. Must be called inside a transaction. """
+        with self.transaction():
+            new_id = self._next_id
+            self._next_id += 1
+            return new_id
+
+    def save(self, stories: list[dict]) -> None:
+        """ Replaces the in-memory copy with the given stories and writes them all to the file. """
+        with self.transaction():
+            with self._lock:
+                self._stories = {story['id']: story for story in stories}
+                self._next_id = max([self._next_id - 1, *self._stories]) + 1
+                self._rebuild_indexes()
+                self._listing = None
+            self._write_snapshot()
+
+    def _write_snapshot(self) -> None:
+        """ Writes all of the stories to the file, replacing any journal. """
+        with self._lock:
+            stories = list(self._stories.values())
+        self._save_metadata()
+        save_to_file(stories, self.path, self.pretty)
+        for path in (self.compacting_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._signature = self._file_signature()
+        self._clear_pending_votes()
+
+    def commit(self, op: str, *stories: dict) -> None:
+        """ Adds or removes the stories for a 'create' or 'delete' and persists the
+            change. A 'vote' or 'update' is made to the stories before committing.
+            Votes are buffered rather than written when vote_flush_ms is set. """
+        with self.transaction():
+            with self._lock:
+                for story in stories:
+                    if op == 'vote' and self.vote_flush_ms:
+                        self._buffer_vote(story)
+                    if op == 'create':
+                        self._stories[story['id']] = story
+                    if op == 'delete':
+                        self._stories.pop(story['id'], None)
+                        self._unindex(story)
+                    else:
+                        self._index(story)
+                if op in ('create', 'delete'):
+                    self._listing = None
+                if op == 'delete':
+                    self._add_tombstones(stories)
+            if op == 'vote' and self.vote_flush_ms:
+                self._schedule_flush()
+                return
+            if not self.journal:
+                self._write_snapshot()
+                return
+            with self._lock:
+                for story in stories:
+                    self._pending_votes.pop(story['id'], None)
+            if op == 'delete':
+                self._save_metadata()
+                records = [{"op": op, "id": story['id']} for story in stories]
+            else:
+                records = [{"op": op, "story": story} for story in stories]
+            self._append_to_journal(records)
+
+    def _add_tombstones(self, stories: tuple[dict]) -> None:
+        """ Records when the stories were deleted, forgetting deletions older
+            than TOMBSTONE_MAX_AGE. """
+        deleted_at = timestamp_now()
+        cutoff = parse_timestamp(deleted_at) - TOMBSTONE_MAX_AGE
+        self._tombstones = [tombstone for tombstone in self._tombstones
+                            if parse_timestamp(tombstone['deleted_at']) >= cutoff]
+        self._tombstones += [{"id": story['id'], "deleted_at": deleted_at} for story in stories]
+
+    def _append_to_journal(self, records: list[dict]) -> None:
+        """ Appends the records to the journal, compacting it once it is large enough. """
+        append_to_journal(records, self.journal_path)
+        self._signature = self._file_signature()
+        if self._signature[2][2] >= self.compact_bytes:
+            self._start_compaction()
+
+    def _buffer_vote(self, story: dict) -> None:
+        """ Adds the change in a voted story's score, found from the score it is
+            still indexed under, to the votes waiting to be written. """
+        delta = story['score'] - self._sort_indexes['score'].key(story['id'])
+        pending_delta = self._pending_votes.get(story['id'], (0, None))[0]
+        self._pending_votes[story['id']] = (pending_delta + delta, story['updated_at'])
+        self._buffered_votes += 1
+        self._votes_modified = time.time()
+
+    def _schedule_flush(self) -> None:
+        """ Writes the buffered votes now if there are enough of them,
+            otherwise makes sure a flush is due within vote_flush_ms. """
+        if self._buffered_votes >= self.vote_flush_count:
+            self._flush_votes()
+        elif self._flush_timer is None:
+            self._flush_timer = Timer(self.vote_flush_ms / 1000, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self) -> None:
+        """ Writes any buffered votes. """
+        if self._pending_votes:
+            with self.transaction():
+                self._flush_votes()
+
+    def _flush_votes(self) -> None:
+        """ Writes the buffered votes, as a snapshot or as journal records. """
+        if not self._pending_votes:
+            self._clear_pending_votes()
+        elif not self.journal:
+            self._write_snapshot()
+        else:
+            with self._lock:
+                records = [{"op": "vote", "story": self._stories[s_id]}
+                           for s_id in self._pending_votes]
+                self._clear_pending_votes()
+            self._append_to_journal(records)
+
+    def _clear_pending_votes(self) -> None:
+        """ Forgets the buffered votes once they have been written. """
+        self._pending_votes = {}
+        self._buffered_votes = 0
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def _start_compaction(self) -> None:
+        """ Starts folding the journal into the stories file on a background thread. """
+        if self._compactor and self._compactor.is_alive():
+            return
+        self._compactor = Thread(target=self.compact, daemon=True)
+        self._compactor.start()
+
+    def compact(self) -> None:
+        """ Writes the current stories as a new snapshot and discards the journal
+            records it contains. New changes keep going to a fresh journal meanwhile.
+
+            A compacting journal found here was left by a compaction that crashed or
+            failed, or that another process hasn't finished. The stories in memory
+            already include it, so it is folded into a snapshot written straight
+            away, and the unfinished compaction then finds its file gone and
+            throws its snapshot away. """
+        with self.transaction():
+            self._flush_votes()
+            if os.path.exists(self.compacting_path):
+                self._write_snapshot()
+                return
+            if not os.path.exists(self.journal_path):
+                return
+            with self._lock:
+                stories = list(self._stories.values())
+            snapshot = encode(stories, self.pretty)
+            self._save_metadata()
+            os.replace(self.journal_path, self.compacting_path)
+            self._signature = self._file_signature()
+            compacting = self._signature[1]
+        try:
+            temp_path = write_temp_file(snapshot, self.path)
+        except BaseException:
+            with self.transaction():
+                if file_signature(self.compacting_path) == compacting:
+                    self._write_snapshot()
+            raise
+        with self.transaction():
+            if file_signature(self.compacting_path) != compacting:
+                os.remove(temp_path)
+                return
+            replace_file(temp_path, self.path)
+            os.remove(self.compacting_path)
+            self._signature = self._file_signature()
+
+
+def get_store():
+    """ Returns the store chosen by the STORAGE_BACKEND environment variable,
+        either 'json' (the default), 'sqlite' or 'postgres'. """
+    backend = os.environ.get("STORAGE_BACKEND", "json")
+    if backend == "sqlite":
+        from sqlite_storage import SQLITE_PATH, SQLiteStore  # pylint: disable=import-outside-toplevel
+        return SQLiteStore(os.environ.get("SQLITE_PATH", SQLITE_PATH))
+    if backend == "postgres":
+        from postgres_storage import POOL_SIZE, PostgresStore  # pylint: disable=import-outside-toplevel
+        return PostgresStore(os.environ["DATABASE_URL"],
+                             max_connections=int(os.environ.get("DATABASE_POOL_SIZE", POOL_SIZE)))
+    return StoryStore(journal=os.environ.get("STORIES_JOURNAL") == "1",
+                      pretty=os.environ.get("STORIES_PRETTY") == "1",
+                      vote_flush_ms=int(os.environ.get("VOTE_FLUSH_MS", 0)),
+                      vote_flush_count=int(os.environ.get("VOTE_FLUSH_COUNT", VOTE_FLUSH_COUNT)))
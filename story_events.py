@@ -0,0 +1,95 @@
+""" Contains a broadcaster that pushes story changes to clients as server-sent events. """
+
+import threading
+from queue import Empty, Full, Queue
+from json_codec import encode
+
+EVENT_QUEUE_SIZE = 1000
+KEEPALIVE_SECONDS = 15
+
+
+def format_event(event: str, data) -> str:
+    """ Returns the event as a server-sent event message. """
+    return f"event: {event}\ndata: {encode(data).decode()}\n\n"
+
+
+def story_delta(event: str, story: dict) -> dict:
+    """ Returns the part of the story a client needs to apply the event to it. """
+    if event == "delete":
+        return {"id": story['id']}
+    if event == "vote":
+        return {"id": story['id'], "score": story['score'], "updated_at": story['updated_at']}
+    return story
+
+
+class StoryEvents():
+    """ Sends each change to the stories to every subscribed client.
+
+        Every subscriber has a queue of messages. A subscriber that falls more
+        than queue_size messages behind is disconnected rather than allowed to
+        hold up the others, and is expected to reconnect and reload the stories.
+        Only changes made by this process are seen. """
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE,
+                 keepalive: float = KEEPALIVE_SECONDS):
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> Queue:
+        """ Returns a new subscriber's queue of messages. """
+        subscriber = Queue(self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Queue) -> None:
+        """ Stops sending messages to the subscriber. """
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event: str, *stories: dict) -> None:
+        """ Sends an event of the given kind, one of 'create', 'vote', 'update'
+            or 'delete', for the stories to every subscriber. """
+        if not stories or not self._subscribers:
+            return
+        message = format_event(event, [story_delta(event, story) for story in stories])
+        with self._lock:
+            for subscriber in list(self._subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except Full:
+                    self._subscribers.discard(subscriber)
+                    self._disconnect(subscriber)
+
+    @staticmethod
+    def _disconnect(subscriber: Queue) -> None:
+        """ Replaces a full subscriber's messages with None, which ends its stream. """
+        try:
+            while True:
+                subscriber.get_nowait()
+        except Empty:
+            pass
+        subscriber.put_nowait(None)
+
+    def stream(self, subscriber: Queue):
+        """ Yields the subscriber's messages as they are published, with a comment
+            every keepalive seconds so idle connections aren't closed. """
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    message = subscriber.get(timeout=self.keepalive)
+                except Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
@@ -1,30 +1,77 @@
 """ Contains tests for the Social News Site. """
 
+import calendar
 import copy
+import gc
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
 from datetime import datetime
+from functools import partial
+from threading import Barrier, Event, Thread
 from unittest.mock import patch, MagicMock
-from api import HelpApp
-from news_scraper import get_html, parse_stories_bs
+from flask.json.provider import DefaultJSONProvider
+import api
+import json_codec
+from api import HelpApp, app
+from indexes import SearchIndex, SortedIndex
+from response_cache import ResponseCache
+import news_scraper
+import storage
+from news_scraper import (DEFAULT_EXTRACTOR, BBCExtractor, Extractor, PromoParser,
+                          get_changed_html, get_extractor, get_html, get_html_pages,
+                          parse_stories_bs, register_extractor, stream_stories)
+from storage import (TIME_FORMAT, ScoreBelowZero, StoryStore, load_from_file, load_from_journal,
+                     normalize_url, parse_timestamp, save_to_file, timestamp_now)
+from scrape_jobs import ScrapeQueue, ScrapeQueueFull, ScrapeScheduler
+from sqlite_storage import SQLiteStore, migrate_from_json
+from story_events import StoryEvents
 from requests import HTTPError
+import pytest
 
 class TestNewsScraper():
     """ Class for Testing the functions in news_scraper.py; """
 
     @staticmethod
-    @patch("news_scraper.urlopen")
-    def test_get_html(mock_open,test_html_bytes):
-        """ Tests whether the urlopen is called, .read() is called and the html is decoded. """
-        mock_response = MagicMock()
-        mock_response.read.return_value = test_html_bytes
+    @patch("news_scraper.SESSION")
+    def test_get_html(mock_session,test_html_bytes):
+        """ Tests whether the shared session is streamed from, with a timeout,
+            and the html is decoded. """
+        mock_response = MagicMock(headers={})
+        mock_response.iter_content.return_value = [test_html_bytes]
 
-        mock_open.return_value.__enter__.return_value = mock_response
+        mock_session.get.return_value.__enter__.return_value = mock_response
 
         html_bytes =  get_html("https://www.newssite.com")
 
-        mock_open.assert_called_once_with("https://www.newssite.com")
-        mock_response.read.assert_called_once()
+        mock_session.get.assert_called_once_with("https://www.newssite.com", stream=True,
+                                                 timeout=10)
+        mock_response.raise_for_status.assert_called_once()
         assert html_bytes == "Hello World!"
 
+    @staticmethod
+    def test_get_html_max_bytes(test_http_server, test_normal_story_A):
+        """ Tests whether a page larger than the byte limit is rejected, changed or not. """
+        test_http_server.pages = {"/news": test_normal_story_A}
+        with pytest.raises(HTTPError, match="larger than 100 bytes"):
+            get_html(test_http_server.url + "/news", max_bytes=100)
+        with pytest.raises(HTTPError, match="larger than 100 bytes"):
+            get_changed_html(test_http_server.url + "/news", {}, max_bytes=100)
+        assert get_html(test_http_server.url + "/news") == test_normal_story_A
+
+    @staticmethod
+    def test_get_html_pages(test_http_server):
+        """ Tests whether the pages are fetched at the same time, in order,
+            with failed pages returned as errors. """
+        test_http_server.barrier = Barrier(2, timeout=5)
+        test_http_server.pages = {"/a": "Page A", "/b": "Page B"}
+        pages = get_html_pages([test_http_server.url + "/a", test_http_server.url + "/b",
+                                test_http_server.url + "/missing"])
+        assert pages[:2] == ["Page A", "Page B"]
+        assert isinstance(pages[2], HTTPError)
+
     @staticmethod
     def test_parse_stories_video(test_video_html, test_normal_story_A):
         """ Tests whether Video stories are skipped over. """
@@ -61,92 +108,366 @@ class TestNewsScraper():
         assert stories[1]['title'] == 'Global Warming: The Impact on Our Oceans'
         assert stories[1]['url'] == 'https://www.newssite.com/news/environment-67890'
 
+    @staticmethod
+    def test_parse_stories_parsers(test_normal_story_A, test_normal_story_B, test_video_html,
+                                   test_language_html):
+        """ Tests whether lxml finds the same stories as html.parser, including promos
+            with more than one class among the rest of a page. """
+        pytest.importorskip("lxml")
+        html = ("<html><body><nav><a href='/sport'>Sport</a></nav>" + test_video_html
+                + test_normal_story_A + test_language_html
+                + test_normal_story_B.replace('class="e1vyq2e80"', 'class="promo e1vyq2e80"')
+                + "</body></html>")
+        stories = parse_stories_bs("https://www.newssite.com", html, "html.parser")
+        assert len(stories) == 2
+        assert parse_stories_bs("https://www.newssite.com", html, "lxml") == stories
+
+    @staticmethod
+    def test_stream_stories(test_http_server, test_normal_story_A, test_normal_story_B):
+        """ Tests whether streaming a page finds the same stories as parsing it whole,
+            with promos split across chunks. """
+        html = ("<html><body>" + test_normal_story_A + "<p>Tom &amp; Jerry<br></p>"
+                + test_normal_story_B + "</body></html>")
+        test_http_server.pages = {"/news": html}
+        with patch('news_scraper.CHUNK_SIZE', 7):
+            stories = list(stream_stories(test_http_server.url + "/news"))
+        assert stories == parse_stories_bs(test_http_server.url + "/news", html)
+        assert len(stories) == 2
+
+    @staticmethod
+    def test_stream_stories_max_bytes(test_http_server, test_normal_story_A):
+        """ Tests whether a page larger than the byte limit is rejected. """
+        test_http_server.pages = {"/news": test_normal_story_A * 10}
+        with pytest.raises(HTTPError, match="larger than 100 bytes"):
+            list(stream_stories(test_http_server.url + "/news", max_bytes=100))
+
+    @staticmethod
+    def test_promo_parser_yields_each_promo(test_normal_story_A, test_normal_story_B):
+        """ Tests whether each promo is available as soon as it has been read. """
+        parser = PromoParser()
+        parser.feed(test_normal_story_A + test_normal_story_B[:40])
+        assert [story['title'] for story in parser.stories("https://www.newssite.com")] == [
+            'Breaking News: New Developments in the Tech Industry']
+        parser.feed(test_normal_story_B[40:])
+        assert len(parser.stories("https://www.newssite.com")) == 1
+
+    @staticmethod
+    def test_get_extractor():
+        """ Tests whether extractors are found by host, including subdomains,
+            falling back to the BBC's. """
+        assert isinstance(get_extractor("https://www.bbc.co.uk/news"), BBCExtractor)
+        assert get_extractor("https://feeds.bbc.com/news") is get_extractor("http://bbc.co.uk")
+        assert get_extractor("https://www.newssite.com") is DEFAULT_EXTRACTOR
+
+    @staticmethod
+    def test_registered_extractor(monkeypatch):
+        """ Tests whether a registered site's stories are parsed with its own selectors
+            and links are joined relative to the page. """
+        monkeypatch.setattr(news_scraper, "EXTRACTORS", dict(news_scraper.EXTRACTORS))
+        register_extractor("othernews.com", Extractor("story-card", "h3.headline"))
+        html = """<article class="story-card"><h3 class="headline">Rates held</h3>
+<a href="economy/rates">More</a></article><article class="story-card"><p>No headline</p></article>"""
+        stories = parse_stories_bs("https://www.othernews.com/business/", html)
+        assert stories == [{'title': 'Rates held',
+                            'url': 'https://www.othernews.com/business/economy/rates'}]
+        parser = PromoParser(get_extractor("https://othernews.com"))
+        parser.feed(html)
+        assert parser.stories("https://www.othernews.com/business/") == stories
+
+    @staticmethod
+    def test_parse_stories_no_prints(test_normal_story_A, capsys):
+        """ Tests whether parsing doesn't print anything. """
+        parse_stories_bs("https://www.newssite.com", test_normal_story_A)
+        assert capsys.readouterr().out == ""
+
+    @staticmethod
+    def test_get_changed_html(test_http_server, test_normal_story_A):
+        """ Tests whether an unchanged page is skipped, by a 304 when the server sends
+            an ETag and by its content hash when it doesn't. """
+        test_http_server.etags = True
+        test_http_server.pages = {"/news": test_normal_story_A}
+        url = test_http_server.url + "/news"
+        page_state = {}
+        assert get_changed_html(url, page_state) == test_normal_story_A
+        assert page_state['etag']
+        assert get_changed_html(url, page_state) is None
+        test_http_server.etags = False
+        assert get_changed_html(url, page_state) is None
+        test_http_server.pages["/news"] = test_normal_story_A + " "
+        assert get_changed_html(url, page_state) == test_normal_story_A + " "
+        assert test_http_server.statuses == [200, 304, 200, 200]
+
 class TestScrapeStories():
     """ Class for testing the /scrape route. """
 
     @staticmethod
-    @patch('api.get_html')
-    @patch('api.save_to_file')
-    @patch('api.load_from_file')
-    def test_scrape(mock_load_stories, mock_save_to_file, mock_get_html, test_client, test_normal_story_A, test_basic_story):
-        """ Tests whether stories are scraped correctly. """
-        mock_get_html.return_value = test_normal_story_A
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
+    def test_scrape(test_client, test_store, test_http_server, test_normal_story_A):
+        """ Tests whether a scrape is queued and its stories are added in the background. """
+        test_http_server.pages = {"/": test_normal_story_A}
         response = test_client.post(
-            "/scrape", json={'url': 'https://www.newssite.com'})
-        assert response.status_code == 201
-        assert mock_load_stories.called is True
-        assert mock_save_to_file.called is True
+            "/scrape", json={'url': test_http_server.url})
+        assert response.status_code == 202
+        job_id = response.json['job_id']
+        assert response.headers['Location'] == f"/scrape/jobs/{job_id}"
+        api.scrape_queue.wait(job_id, timeout=5)
+        saved_stories = load_from_file(test_store.path)
+        assert len(saved_stories) == 5
+        assert saved_stories[-1]['url'] == test_http_server.url + '/news/technology-12345'
+        response = test_client.get(f"/scrape/jobs/{job_id}")
+        assert response.status_code == 200
+        assert response.json['status'] == 'done'
+        assert response.json['added'] == 1
+        assert response.json['duplicates'] == 0
 
     @staticmethod
-    @patch('api.get_html')
-    @patch('api.save_to_file')
-    @patch('api.load_from_file')
+    def test_scrape_duplicates(test_client, test_store, test_http_server,
+                               test_normal_story_A, test_normal_story_B):
+        """ Tests whether stories already on the site, or repeated on the page, are skipped. """
+        test_http_server.pages = {"/": test_normal_story_A + test_normal_story_A}
+        response = test_client.post("/scrape", json={'url': test_http_server.url})
+        assert api.scrape_queue.wait(response.json['job_id'], timeout=5)['duplicates'] == 1
+        test_http_server.pages = {"/": test_normal_story_A + test_normal_story_B}
+        response = test_client.post(
+            "/scrape", json={'url': test_http_server.url})
+        job = api.scrape_queue.wait(response.json['job_id'], timeout=5)
+        assert (job['added'], job['duplicates']) == (1, 1)
+        assert len(load_from_file(test_store.path)) == 6
 
-    def test_invalid_url(mock_load_stories, _, mock_get_html, test_client, test_basic_story):
-        """ Tests whether a bad request error is returned for an invalid URL. 
-            (which raises a HTTPError) """
-        mock_get_html.side_effect = HTTPError("Invalid Url. ")
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
+    @staticmethod
+    def test_scrape_many_urls(test_client, test_store, test_http_server,
+                              test_normal_story_A, test_normal_story_B):
+        """ Tests whether several links are fetched at the same time and their stories
+            added together, skipping duplicates and reporting links that failed. """
+        test_http_server.barrier = Barrier(2, timeout=5)
+        test_http_server.pages = {"/news": test_normal_story_A + test_normal_story_B,
+                                  "/sport": test_normal_story_A}
+        response = test_client.post("/scrape", json={'urls': [
+            test_http_server.url + "/news", test_http_server.url + "/sport",
+            test_http_server.url + "/missing"]})
+        assert response.status_code == 202
+        job = api.scrape_queue.wait(response.json['job_id'], timeout=10)
+        assert job['status'] == 'done'
+        assert job['failed_urls'] == [test_http_server.url + "/missing"]
+        assert len(load_from_file(test_store.path)) == 6
 
-        response = test_client.post(
-            "/scrape", json={'url': 'https://www.newssite.com'})
+    @staticmethod
+    def test_scrape_invalid_urls(test_client, test_store):
+        """ Tests whether a bad request error is returned when urls isn't a list of links. """
+        response = test_client.post("/scrape", json={'urls': "https://www.newssite.com"})
+        assert response.status_code == 400
+        response = test_client.post("/scrape", json={'urls': []})
         assert response.status_code == 400
 
     @staticmethod
-    @patch('api.load_from_file')
+    def test_invalid_url(test_client, test_store):
+        """ Tests whether the job fails for an invalid URL. 
+            (which raises a HTTPError) """
+        response = test_client.post(
+            "/scrape", json={'url': 'www.newssite.com'})
+        job = api.scrape_queue.wait(response.json['job_id'], timeout=5)
+        assert job['status'] == 'failed'
+        assert job['message'] == "URL must be a valid url. "
 
-    def test_no_url_header(_, test_client):
+    @staticmethod
+    def test_no_url_header(test_client, test_store):
         """ Tests whether a bad request error is returned when the head is not 'url'. """
         response = test_client.post(
             "/scrape", json={'link': 'https://www.newssite.com'})
         assert response.status_code == 400
 
     @staticmethod
-    @patch('api.get_html')
-    @patch('api.load_from_file')
-    def test_no_scraped_stories(mock_load_stories, mock_get_html, test_client, test_basic_story):
-        """ Tests whether a not found error is returned when no stories are scraped. """
-        mock_get_html.return_value = ""
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
+    def test_no_scraped_stories(test_client, test_store, test_http_server):
+        """ Tests whether the job fails when no stories are scraped. """
+        test_http_server.pages = {"/": ""}
 
         response = test_client.post(
-            "/scrape", json={'url': 'https://www.newssite.com'})
+            "/scrape", json={'url': test_http_server.url})
+        job = api.scrape_queue.wait(response.json['job_id'], timeout=5)
+        assert job['status'] == 'failed'
+        assert job['message'] == "No stories found."
+
+    @staticmethod
+    def test_job_not_found(test_client):
+        """ Tests whether a not found error is returned for an unknown job. """
+        response = test_client.get("/scrape/jobs/missing")
         assert response.status_code == 404
+        assert response.json['message'] == "Job not found"
+
+
+class TestScrapeQueue():
+    """ Class for testing the ScrapeQueue class. """
+
+    @staticmethod
+    def test_workers_limit():
+        """ Tests whether jobs beyond the number of workers wait in the queue. """
+        queue = ScrapeQueue(workers=1)
+        release = Event()
+        first_id = queue.submit(lambda urls: release.wait(5) and {}, ["a"])
+        second_id = queue.submit(lambda urls: {"added": 2}, ["b"])
+        assert queue.get(second_id)['status'] == 'queued'
+        release.set()
+        assert queue.wait(second_id, timeout=5)['added'] == 2
+        assert queue.get(first_id)['status'] == 'done'
+        queue.shutdown()
+
+    @staticmethod
+    def test_forget_finished():
+        """ Tests whether only the most recent finished jobs are remembered. """
+        queue = ScrapeQueue(workers=1, max_jobs=2)
+        job_ids = []
+        for _ in range(3):
+            job_ids.append(queue.submit(lambda urls: {}, []))
+            queue.wait(job_ids[-1], timeout=5)
+        assert queue.get(job_ids[0]) is None
+        assert queue.get(job_ids[2])['status'] == 'done'
+        queue.shutdown()
+
+    @staticmethod
+    def test_queue_full(test_client, monkeypatch):
+        """ Tests whether scrapes past max_queued unfinished jobs are refused until one finishes. """
+        queue = ScrapeQueue(workers=1, max_queued=2)
+        monkeypatch.setattr(api, "scrape_queue", queue)
+        release = Event()
+        queue.submit(lambda urls: release.wait(5) and {}, ["a"])
+        second_id = queue.submit(lambda urls: {}, ["b"])
+        with pytest.raises(ScrapeQueueFull):
+            queue.submit(lambda urls: {}, ["c"])
+        response = test_client.post("/scrape", json={"url": "https://www.bbc.co.uk/news"})
+        assert response.status_code == 503
+        release.set()
+        queue.wait(second_id, timeout=5)
+        assert queue.wait(queue.submit(lambda urls: {}, ["c"]), timeout=5)['status'] == 'done'
+        queue.shutdown()
+
+
+class TestScrapeScheduler():
+    """ Class for testing the ScrapeScheduler class. """
+
+    @staticmethod
+    def test_poll_skips_unchanged(test_store, test_http_server, test_normal_story_A):
+        """ Tests whether a second poll of an unchanged feed adds nothing without parsing it. """
+        test_http_server.etags = True
+        test_http_server.pages = {"/news": test_normal_story_A}
+        queue = ScrapeQueue(workers=1)
+        scheduler = ScrapeScheduler(queue, partial(HelpApp.scrape_stories, test_store),
+                                    [test_http_server.url + "/news"])
+        assert queue.wait(scheduler.poll(), timeout=5)['added'] == 1
+        with patch('api.parse_stories_bs') as mock_parse:
+            job = queue.wait(scheduler.poll(), timeout=5)
+            assert mock_parse.called is False
+        assert job['status'] == 'done'
+        assert job['added'] == 0
+        assert job['unchanged_urls'] == [test_http_server.url + "/news"]
+        assert len(load_from_file(test_store.path)) == 5
+        queue.shutdown()
+
+    @staticmethod
+    def test_poll_waits_for_last_job():
+        """ Tests whether a poll is skipped while the last one is still running. """
+        queue = ScrapeQueue(workers=1)
+        release = Event()
+        scheduler = ScrapeScheduler(queue, lambda urls, page_states: release.wait(5) and {},
+                                    ["https://www.newssite.com"])
+        assert scheduler.poll()
+        assert scheduler.poll() is None
+        release.set()
+        queue.shutdown()
 
 
 class TestStories():
     """ Class for Testing the /stories route. """
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_stories_get(mock_load_stories, test_client, test_basic_story):
+    def test_stories_get(test_client, test_store, test_basic_story):
         """ Tests whether the route loads the stories for a get request. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.get("/stories")
         assert response.status_code == 200
-        assert mock_load_stories.called is True
+        assert response.json == test_basic_story
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_stories_search(mock_load_stories, test_client, test_basic_story):
+    def test_stories_search(test_client, test_store):
         """ Tests whether the route loads only matching stories 
             for a get request with a search query. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.get("/stories?search=boost")
         assert response.status_code == 200
         assert len(response.json) == 1
         assert "boost" in response.json[0]['title']
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_stories_get_error(mock_load_stories, test_client, test_empty_story):
+    def test_stories_sort_created(test_client, test_store, test_created_at_ascending_stories):
+        """ Tests whether sorting by creation date uses the stored timestamps
+            rather than parsing them on every request. """
+        test_store.load()
+        with patch('storage.parse_timestamp') as mock_parse, \
+             patch('api.parse_timestamp') as mock_api_parse:
+            response = test_client.get("/stories?sort=created&order=ascending")
+            assert mock_parse.called is False
+            assert mock_api_parse.called is False
+        assert response.status_code == 200
+        assert response.json == test_created_at_ascending_stories
+
+    @staticmethod
+    def test_stories_sort_score_after_vote(test_client, test_store):
+        """ Tests whether a vote moves the story to its new place in the score order. """
+        for _ in range(60):
+            test_client.post("/stories/1/votes", json={"direction": "up"})
+
+        response = test_client.get("/stories?sort=score&order=descending")
+        assert [story['id'] for story in response.json] == [1, 4, 5, 3]
+        assert response.json[0]['score'] == 102
+
+    @staticmethod
+    def test_stories_sort_title_after_update(test_client, test_store):
+        """ Tests whether changing a title moves the story to its new place in the title order. """
+        test_client.patch("/stories/4", json={"title": "Aardvarks are back"})
+
+        response = test_client.get("/stories?sort=title&order=ascending")
+        assert [story['id'] for story in response.json] == [4, 5, 3, 1]
+
+    @staticmethod
+    def test_stories_page(test_client, test_store, test_score_ascending_stories):
+        """ Tests whether a limit returns one page of sorted stories and the next offset. """
+        response = test_client.get("/stories?sort=score&order=ascending&limit=3")
+        assert response.status_code == 200
+        assert response.json['stories'] == test_score_ascending_stories[:3]
+        assert response.json['next_offset'] == 3
+        assert response.json['total'] == 4
+
+        response = test_client.get("/stories?sort=score&order=ascending&limit=3&offset=3")
+        assert response.json['stories'] == test_score_ascending_stories[3:]
+        assert response.json['next_offset'] is None
+
+    @staticmethod
+    def test_stories_page_search(test_client, test_store):
+        """ Tests whether paging applies to the stories matching the search. """
+        response = test_client.get("/stories?search=in&sort=title&order=descending&limit=1")
+        assert response.status_code == 200
+        assert [story['id'] for story in response.json['stories']] == [1]
+        assert response.json['next_offset'] == 1
+        assert response.json['total'] == 3
+
+    @staticmethod
+    def test_stories_page_invalid(test_client, test_store):
+        """ Tests whether a bad request error is returned for an invalid limit or offset. """
+        for query in ["limit=0", "limit=1000", "limit=ten", "limit=2&offset=-1", "limit=²",
+                      "limit=5&offset=²", "limit=5&offset=99999999999999999999999"]:
+            response = test_client.get(f"/stories?{query}")
+            assert response.status_code == 400
+            assert response.json['error'] is True
+
+    @staticmethod
+    def test_stories_search_after_update(test_client, test_store):
+        """ Tests whether the search finds a story by its edited title only. """
+        test_client.patch("/stories/5", json={"title": "Chancellor sets out spending plans"})
+
+        assert test_client.get("/stories?search=boost").json == []
+        response = test_client.get("/stories?search=SPENDING")
+        assert [story['id'] for story in response.json] == [5]
+
+    @staticmethod
+    def test_stories_get_error(test_client, test_empty_store):
         """ Tests whether the route sends a not found error 
             for a get request when no stories are found. """
-        mock_load_stories.return_value = test_empty_story
-
         response = test_client.get("/stories")
 
         assert response.status_code == 404
@@ -156,27 +477,29 @@ class TestStories():
         assert response.json['error'] is True
 
     @staticmethod
-    @patch('api.load_from_file')
-    @patch('api.save_to_file')
-    def test_post_stories(mock_write_to_file, mock_load_stories, test_client, test_basic_story, test_url, test_title):
+    def test_post_stories(test_client, test_store, test_url, test_title):
         """ Tests whether the route adds a story for a post request. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.post("/stories", json=test_url | test_title)
 
         assert response.status_code == 201
         assert 'message' in response.json
         assert 'Added Successfully' in response.json['message']
-        assert mock_write_to_file.called is True
+        assert load_from_file(test_store.path)[-1]['title'] == test_title['title']
 
     @staticmethod
-    @patch('api.load_from_file')
-    @patch('api.save_to_file')
-    def test_post_stories_error(_, mock_load_stories, test_client, test_basic_story, test_title):
+    def test_post_stories_duplicate(test_client, test_store, test_title):
+        """ Tests whether the route sends a conflict error for a url that is already on the site. """
+        response = test_client.post("/stories", json=test_title | {
+            "url": "http://bbc.co.uk/news/business-64949083/?utm_source=twitter"})
+
+        assert response.status_code == 409
+        assert response.json['error'] is True
+        assert len(load_from_file(test_store.path)) == 4
+
+    @staticmethod
+    def test_post_stories_error(test_client, test_store, test_title):
         """ Tests whether the route sends a bad request error 
             for a post request that is missing data. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.post("/stories", json=test_title)
 
         assert response.status_code == 400
@@ -186,51 +509,180 @@ class TestStories():
         assert response.json['error'] is True
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_stories_invalid_method(mock_load_stories, test_client, test_basic_story):
+    def test_post_stories_invalid_url(test_client, test_store, test_title):
+        """ Tests whether a story whose url has no scheme or host is rejected. """
+        response = test_client.post("/stories", json=test_title | {"url": "a.com"})
+        assert response.status_code == 400
+        assert response.json['error'] is True
+        assert test_store.count() == 4
+
+    @staticmethod
+    def test_stories_invalid_method(test_client, test_store):
         """ Tests whether the route sends a method not allowed error 
             when the request method is not one allowed by the route. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
         response = test_client.delete("/stories")
         assert response.status_code == 405
 
 
+class TestCaching():
+    """ Class for Testing the caching headers. """
+
+    @staticmethod
+    def test_stories_etag(test_client, test_store):
+        """ Tests whether an unchanged list gets a 304 with no body, and a changed one doesn't. """
+        response = test_client.get("/stories?sort=score")
+        etag = response.headers['ETag']
+        assert response.headers['Cache-Control'] == "no-cache"
+        with patch.object(HelpApp, 'search_sort') as mock_search_sort:
+            response = test_client.get("/stories?sort=score", headers={"If-None-Match": etag})
+            assert mock_search_sort.called is False
+        assert response.status_code == 304
+        assert response.data == b""
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        response = test_client.get("/stories?sort=score", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    @staticmethod
+    def test_stories_weak_etag(test_client, test_store):
+        """ Tests whether a weak form of the tag, as proxies that compress the body
+            send back, still gets a 304. """
+        etag = test_client.get("/stories").headers['ETag']
+        response = test_client.get("/stories", headers={"If-None-Match": f"W/{etag}"})
+        assert response.status_code == 304
+
+    @staticmethod
+    def test_stories_if_modified_since(test_client, test_store):
+        """ Tests whether a list dated no earlier than the last change gets a 304. """
+        last_modified = test_client.get("/stories").headers['Last-Modified']
+        response = test_client.get("/stories", headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 304
+        response = test_client.get(
+            "/stories", headers={"If-Modified-Since": "Sun, 20 Mar 2022 08:43:21 GMT"})
+        assert response.status_code == 200
+
+    @staticmethod
+    def test_etag_matches_across_stores(test_store):
+        """ Tests whether two stores reading the same file give the same tag,
+            until one of them has buffered votes. """
+        other_store = StoryStore(test_store.path, vote_flush_ms=60000)
+        assert other_store.version() == test_store.version()
+        with other_store.transaction():
+            story = other_store.get(1)
+            story['score'] += 1
+            other_store.commit("vote", story)
+        assert other_store.version()[0] != test_store.version()[0]
+        other_store.flush()
+        assert other_store.version() == test_store.version()
+
+    @staticmethod
+    def test_stories_response_cached(test_client, test_backend):
+        """ Tests whether a repeated listing is sent from the cache without sorting or
+            encoding, and whether a change to the stories is shown straight away. """
+        response = test_client.get("/stories?sort=score&order=descending")
+        with patch.object(HelpApp, 'search_sort') as mock_search_sort, \
+                patch.object(app.json, 'response') as mock_response:
+            cached = test_client.get("/stories?sort=score&order=descending")
+            assert mock_search_sort.called is False
+            assert mock_response.called is False
+        assert cached.data == response.data
+        assert cached.status_code == 200
+        assert cached.content_type == "application/json"
+        assert cached.headers['ETag'] == response.headers['ETag']
+        score = next(story['score'] for story in cached.json if story['id'] == 1)
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        response = test_client.get("/stories?sort=score&order=descending")
+        assert next(story['score'] for story in response.json if story['id'] == 1) == score + 1
+
+    @staticmethod
+    def test_stories_error_cached(test_client, test_store):
+        """ Tests whether a listing that found nothing keeps its status when cached. """
+        test_client.get("/stories?search=nothing&sort=score")
+        response = test_client.get("/stories?search=NOTHING&sort=score")
+        assert response.status_code == 404
+        assert len(api.response_cache) == 1
+
+    @staticmethod
+    def test_static_cache_control(test_client):
+        """ Tests whether scripts can be kept by browsers while pages are always checked. """
+        response = test_client.get("/static/index.js")
+        assert response.headers['Cache-Control'] == "public, max-age=86400"
+        response.close()
+        response = test_client.get("/")
+        assert "no-cache" in response.headers['Cache-Control']
+        response.close()
+
+
+class TestResponseCache():
+    """ Class for Testing the cache of rendered responses. """
+
+    @staticmethod
+    def test_get_put():
+        """ Tests whether a cached response is returned for its query and version only. """
+        cache = ResponseCache()
+        cache.put("1", ("a",), b"[]", 200)
+        assert cache.get("1", ("a",)) == (b"[]", 200)
+        assert cache.get("1", ("b",)) is None
+        assert cache.get("2", ("a",)) is None
+        assert cache.get("1", ("a",)) is None
+
+    @staticmethod
+    def test_size_bound():
+        """ Tests whether the least recently used responses are dropped past the limits. """
+        cache = ResponseCache(max_entries=2, max_bytes=10)
+        cache.put("1", ("a",), b"1234", 200)
+        cache.put("1", ("b",), b"1234", 200)
+        cache.get("1", ("a",))
+        cache.put("1", ("c",), b"1234", 200)
+        assert cache.get("1", ("b",)) is None
+        assert cache.get("1", ("a",)) is not None
+        cache.put("1", ("d",), b"12345678", 200)
+        assert len(cache) == 1
+        cache.put("1", ("e",), b"12345678901", 200)
+        assert cache.get("1", ("e",)) is None
+
+
 class TestStoryVote():
     """ Class for Testing the /stories/<int:s_id>/votes route. """
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_upvote(mock_load_stories, test_client, test_basic_story):
-        """ Tests whether the route updates a given story by +1 vote when direction is up. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
+    def test_story_upvote(test_client, test_store):
+        """ Tests whether the route updates a given story by +1 vote when direction is up,
+            and responds with the voted story. """
         response = test_client.post(
             "/stories/1/votes", json={"direction": "up"})
         assert response.status_code == 201
         assert 'message' in response.json
         assert 'Updated Successfully' in response.json['message']
-        assert mock_load_stories.called is True
+        assert load_from_file(test_store.path)[0]['score'] == 43
+        assert response.json['story'] == load_from_file(test_store.path)[0]
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_downvote(mock_load_stories, test_client, test_basic_story):
+    def test_story_downvote(test_client, test_store):
         """ Tests whether the route updates a given story by -1 vote when direction is down. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.post(
             "/stories/1/votes", json={"direction": "down"})
         assert response.status_code == 201
         assert 'message' in response.json
         assert 'Updated Successfully' in response.json['message']
-        assert mock_load_stories.called is True
+        assert load_from_file(test_store.path)[0]['score'] == 41
+
+    @staticmethod
+    def test_story_downvote_score_changed(test_client, test_store):
+        """ Tests whether a downvote the store refuses, as the score reached 0 after it
+            was read, is reported as a bad request and not saved. """
+        with patch.object(test_store, 'commit', side_effect=ScoreBelowZero):
+            response = test_client.post("/stories/1/votes", json={"direction": "down"})
+            assert response.status_code == 400
+            response = test_client.post("/stories/batch/votes",
+                                        json=[{"id": 1, "direction": "down"}])
+            assert response.status_code == 400
+        assert test_store.get(1)['score'] == 42
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_downvote_zero_score(mock_load_stories, test_client, test_basic_story):
+    def test_story_downvote_zero_score(test_client, test_store):
         """ Tests whether the route returns a bad request error 
             when trying to downvote a stories with 0 votes. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.post(
             "/stories/3/votes", json={"direction": "down"})
         assert response.status_code == 400
@@ -240,15 +692,11 @@ class TestStoryVote():
         assert response.json['error'] is True
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_votes_id_not_found(mock_load_stories, test_client, test_basic_story):
+    def test_story_votes_id_not_found(test_client, test_store):
         """ Tests whether the not found error is returned when 
             trying to change the votes of a story that does not exist. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.post(
             "/stories/6/votes", json={"direction": "down"})
-        assert mock_load_stories.called is True
         assert response.status_code == 404
 
         assert 'error' in response.json
@@ -257,12 +705,9 @@ class TestStoryVote():
         assert response.json['error'] is True
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_votes_wrong_direction(mock_load_stories, test_client, test_basic_story):
+    def test_story_votes_wrong_direction(test_client, test_store):
         """ Tests whether the bad request error is returned 
             when the direction given is not up or down. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.post(
             "/stories/1/votes", json={"direction": "unknown"})
         assert response.status_code == 400
@@ -272,11 +717,9 @@ class TestStoryVote():
         assert response.json['error'] is True
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_stories_invalid_method(mock_load_stories, test_client, test_basic_story):
+    def test_stories_invalid_method(test_client, test_store):
         """ Tests whether the route sends a method not allowed error 
             when the request method is not one allowed by the route. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
         response = test_client.delete("/stories")
         assert response.status_code == 405
 
@@ -286,54 +729,54 @@ class TestStoriesID():
     """ Class for Testing the /stories/<int:s_id> route. """
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_update_title_url(mock_load_stories, test_client, 
-                                    test_basic_story, test_title, test_url):
-        """ Tests whether the route updates the title and url of a story when both are given. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
+    def test_story_update_title_url(test_client, test_store, test_title, test_url):
+        """ Tests whether the route updates the title and url of a story when both are given,
+            and responds with the updated story. """
         response = test_client.patch(
             "/stories/1", json=test_title | test_url)
         assert response.status_code == 201
         assert 'message' in response.json
         assert 'Updated Successfully' in response.json['message']
-        assert mock_load_stories.called is True
+        saved_story = load_from_file(test_store.path)[0]
+        assert saved_story['title'] == test_title['title']
+        assert saved_story['url'] == test_url['url']
+        assert response.json['story'] == saved_story
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_update_title(mock_load_stories, test_client, test_basic_story, test_title):
+    def test_story_update_title(test_client, test_store, test_title):
         """ Tests whether the route updates the title of a story when given. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.patch(
             "/stories/1", json=test_title)
         assert response.status_code == 201
         assert 'message' in response.json
         assert 'Updated Successfully' in response.json['message']
-        assert mock_load_stories.called is True
+        assert load_from_file(test_store.path)[0]['title'] == test_title['title']
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_update_url(mock_load_stories, test_client, test_basic_story, test_url):
+    def test_story_update_url(test_client, test_store, test_url):
         """ Tests whether the route updates the url of a story when given. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.patch(
             "/stories/1", json=test_url)
         assert response.status_code == 201
         assert 'message' in response.json
         assert 'Updated Successfully' in response.json['message']
-        assert mock_load_stories.called is True
+        assert load_from_file(test_store.path)[0]['url'] == test_url['url']
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_update_id_not_found(mock_load_stories, test_client, test_basic_story, test_url):
-        """ Tests whether the not found error is returned when trying to update a story that does not exist. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
+    def test_story_update_invalid_url(test_client, test_store, test_basic_story):
+        """ Tests whether a url without a scheme and host is rejected before the story is changed. """
+        response = test_client.patch("/stories/1", json={"url": "bad"})
+        assert response.status_code == 400
+        assert response.json['error'] is True
+        test_client.post("/stories/2/votes", json={"direction": "up"})
+        assert load_from_file(test_store.path)[0]['url'] == test_basic_story[0]['url']
+        assert test_store.has_url(test_basic_story[0]['url'])
 
+    @staticmethod
+    def test_story_update_id_not_found(test_client, test_store, test_url):
+        """ Tests whether the not found error is returned when trying to update a story that does not exist. """
         response = test_client.patch(
             "/stories/6", json=test_url)
-        assert mock_load_stories.called is True
         assert response.status_code == 404
 
         assert 'error' in response.json
@@ -342,27 +785,21 @@ class TestStoriesID():
         assert response.json['error'] is True
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_delete(mock_load_stories, test_client, test_basic_story):
+    def test_story_delete(test_client, test_store):
         """ Tests whether the story is deleted from the list. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.delete(
             "/stories/1")
         assert response.status_code == 201
         assert 'message' in response.json
         assert 'Deleted Successfully' in response.json['message']
-        assert mock_load_stories.called is True
+        assert 1 not in [story['id'] for story in load_from_file(test_store.path)]
+        assert test_store.get(1) is None
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_story_delete_not_found(mock_load_stories, test_client, test_basic_story):
+    def test_story_delete_not_found(test_client, test_store):
         """ Tests whether the not found error is returned when trying to delete a story that does not exist. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
-
         response = test_client.delete(
             "/stories/6")
-        assert mock_load_stories.called is True
         assert response.status_code == 404
 
         assert 'error' in response.json
@@ -371,14 +808,737 @@ class TestStoriesID():
         assert response.json['error'] is True
 
     @staticmethod
-    @patch('api.load_from_file')
-    def test_stories_invalid_method(mock_load_stories, test_client, test_basic_story):
+    def test_stories_invalid_method(test_client, test_store):
         """ Tests whether the route sends a method not allowed error when the request method is not one allowed by the route. """
-        mock_load_stories.return_value = copy.deepcopy(test_basic_story)
         response = test_client.delete("/stories")
         assert response.status_code == 405
 
 
+class TestBatch():
+
+    """ Class for Testing the batch routes. """
+
+    @staticmethod
+    def test_batch_create(test_client, test_store, test_url, test_title):
+        """ Tests whether new stories are added in one write, with a result for each. """
+        with patch('storage.save_to_file', wraps=save_to_file) as mock_save:
+            response = test_client.post("/stories/batch", json=[
+                test_url | test_title,
+                {"url": "https://www.bbc.co.uk/news/uk-1", "title": "Another story"},
+                test_url | test_title,
+                {"title": "No url"},
+                {"url": "a.com", "title": "Not a link"}])
+            assert mock_save.call_count == 1
+        assert response.status_code == 200
+        assert [result['status'] for result in response.json['results']] == [
+            201, 201, 409, 400, 400]
+        assert [result.get('id') for result in response.json['results']] == [
+            6, 7, None, None, None]
+        assert test_store.get(7)['title'] == "Another story"
+
+    @staticmethod
+    def test_batch_votes(test_client, test_store):
+        """ Tests whether votes are applied in order, including on the same story,
+            and invalid ones are rejected without stopping the rest. """
+        response = test_client.post("/stories/batch/votes", json=[
+            {"id": 3, "direction": "up"},
+            {"id": 3, "direction": "down"},
+            {"id": 3, "direction": "down"},
+            {"id": 1, "direction": "sideways"},
+            {"id": 6, "direction": "up"},
+            {"id": True, "direction": "up"},
+            {"id": 1, "direction": "up"}])
+        assert response.status_code == 200
+        assert [result['status'] for result in response.json['results']] == [
+            201, 201, 400, 400, 404, 404, 201]
+        assert load_from_file(test_store.path)[0]['score'] == 43
+        assert test_store.get(3)['score'] == 0
+
+    @staticmethod
+    def test_batch_delete(test_client, test_store):
+        """ Tests whether stories are deleted together, with missing ids reported. """
+        response = test_client.delete("/stories/batch", json=[{"id": 1}, {"id": 1}, {"id": "3"},
+                                                              {"id": True}, {"id": 4}])
+        assert [result['status'] for result in response.json['results']] == [
+            201, 404, 404, 404, 201]
+        assert [story['id'] for story in load_from_file(test_store.path)] == [3, 5]
+
+    @staticmethod
+    def test_batch_invalid(test_client, test_store):
+        """ Tests whether a batch that isn't a list of objects is rejected. """
+        assert test_client.post("/stories/batch", json={"url": "x"}).status_code == 400
+        assert test_client.post("/stories/batch/votes", json=[]).status_code == 400
+        assert test_client.delete("/stories/batch", json=[1, 2]).status_code == 400
+
+
+class TestStoryEvents():
+    """ Class for Testing the stream of story changes. """
+
+    @staticmethod
+    def test_stream_changes(test_client, test_store):
+        """ Tests whether votes, edits, new and deleted stories are streamed as small events,
+            and whether the subscriber is dropped once the stream is closed. """
+        response = test_client.get("/stories/stream", buffered=False)
+        assert response.mimetype == "text/event-stream"
+        events = response.iter_encoded()
+        assert next(events) == b": connected\n\n"
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        event = next(events).decode()
+        assert event.startswith("event: vote\ndata: ")
+        assert set(json.loads(event.split("data: ")[1])[0]) == {"id", "score", "updated_at"}
+        test_client.patch("/stories/1", json={"title": "New title"})
+        assert '"title":"New title"' in next(events).decode()
+        test_client.post("/stories", json={"url": "https://www.bbc.co.uk/news/1", "title": "New"})
+        assert next(events).startswith(b"event: create\n")
+        test_client.delete("/stories/1")
+        assert next(events) == b'event: delete\ndata: [{"id":1}]\n\n'
+        response.close()
+        assert len(api.story_events) == 0
+
+    @staticmethod
+    def test_empty_change_not_streamed():
+        """ Tests whether nothing is published for a change to no stories, such as a failed batch. """
+        events = StoryEvents()
+        subscriber = events.subscribe()
+        events.publish("vote")
+        assert subscriber.empty()
+
+    @staticmethod
+    def test_slow_subscriber_disconnected():
+        """ Tests whether a subscriber that falls behind is ended without holding up the others. """
+        events = StoryEvents(queue_size=2, keepalive=0.01)
+        slow = events.subscribe()
+        fast = events.subscribe()
+        fast_stream = events.stream(fast)
+        next(fast_stream)
+        for s_id in range(3):
+            events.publish("delete", {"id": s_id})
+            assert next(fast_stream).startswith("event: delete")
+        assert list(events.stream(slow)) == [": connected\n\n"]
+        assert len(events) == 1
+        assert next(fast_stream) == ": keepalive\n\n"
+
+
+class TestJSONCodec():
+    """ Class for Testing the JSON codec and the app's JSON provider. """
+
+    @staticmethod
+    @pytest.mark.parametrize("fast", [True, False])
+    def test_encode_decode(test_basic_story, fast):
+        """ Tests whether stories survive a round trip, with and without orjson. """
+        with patch('json_codec.orjson', json_codec.orjson if fast else None):
+            data = json_codec.encode(test_basic_story)
+            assert b"\n" not in data
+            assert json_codec.decode(data) == test_basic_story
+            assert json_codec.decode(json_codec.encode(test_basic_story, pretty=True)) \
+                == test_basic_story
+            with pytest.raises(json.JSONDecodeError):
+                json_codec.decode(b'{"id": 1')
+
+    @staticmethod
+    def test_provider_matches_flask():
+        """ Tests whether responses hold the same JSON as Flask's own provider gives,
+            dates included. """
+        data = {"stories": [{"id": 1, "title": "Caf\u00e9"}], "at": datetime(2022, 3, 20, 8, 43, 21)}
+        with app.app_context():
+            fast = app.json.response(data)
+            flask_json = DefaultJSONProvider(app)
+            assert json.loads(fast.get_data()) == json.loads(flask_json.response(data).get_data())
+            assert app.json.loads(app.json.dumps(data))['at'] == "Sun, 20 Mar 2022 08:43:21 GMT"
+
+
+class TestStoryStore():
+
+    """ Class for Testing the StoryStore class. """
+
+    @staticmethod
+    def test_load_is_cached(test_store):
+        """ Tests whether the stories are only parsed once while the file is unchanged. """
+        first_load = test_store.load()
+        with patch('storage.load_from_file') as mock_load:
+            assert test_store.load() is first_load
+            assert test_store.get(1) is first_load[0]
+            assert mock_load.called is False
+
+    @staticmethod
+    def test_load_reloads_changed_file(test_store, test_basic_story):
+        """ Tests whether the stories are re-read when another writer changes the file. """
+        test_store.load()
+        save_to_file(test_basic_story[:2], test_store.path)
+        assert len(test_store.load()) == 2
+
+    @staticmethod
+    def test_load_missing_file(tmp_path):
+        """ Tests whether a missing file is treated as an empty list of stories. """
+        assert StoryStore(str(tmp_path / "missing.json")).load() == []
+
+    @staticmethod
+    @pytest.mark.parametrize("journal", [False, True])
+    def test_failed_transaction_undone(tmp_path, test_basic_story, journal):
+        """ Tests whether a change made in memory is thrown away when its transaction fails,
+            so a later commit doesn't write it. """
+        store = StoryStore(str(tmp_path / "stories.json"), journal=journal)
+        store.save(copy.deepcopy(test_basic_story))
+        with pytest.raises(IndexError), store.transaction():
+            store.get(1)['url'] = "bad"
+            raise IndexError
+        assert store.get(1)['url'] == test_basic_story[0]['url']
+        with store.transaction():
+            story = store.get(3)
+            story['score'] += 1
+            store.commit("vote", story)
+        assert StoryStore(store.path, journal=journal).get(1)['url'] == test_basic_story[0]['url']
+
+    @staticmethod
+    @pytest.mark.parametrize("pretty", [False, True])
+    def test_file_format(tmp_path, test_basic_story, pretty):
+        """ Tests whether stories.json is compact unless pretty printing is asked for,
+            and whether it reads back the same either way. """
+        store = StoryStore(str(tmp_path / "stories.json"), pretty=pretty)
+        store.save(copy.deepcopy(test_basic_story))
+        with open(store.path, encoding="UTF-8") as file:
+            text = file.read()
+        assert ("\n" in text) is pretty
+        assert load_from_file(store.path) == test_basic_story
+
+    @staticmethod
+    @pytest.mark.parametrize("journal", [False, True])
+    def test_tombstones_saved(tmp_path, test_basic_story, journal):
+        """ Tests whether deletions are seen by another store reading the same files,
+            and whether tombstones older than TOMBSTONE_MAX_AGE are forgotten. """
+        store = StoryStore(str(tmp_path / "stories.json"), journal=journal)
+        store.save(copy.deepcopy(test_basic_story))
+        with store.transaction():
+            store.commit("delete", store.get(1))
+        other_store = StoryStore(store.path, journal=journal)
+        assert [tombstone['id'] for tombstone in other_store.changes(0)[1]] == [1]
+        with patch('storage.TOMBSTONE_MAX_AGE', -1), other_store.transaction():
+            other_store.commit("delete", other_store.get(3))
+        assert [tombstone['id'] for tombstone in store.changes(0)[1]] == [3]
+
+    @staticmethod
+    def test_journal_after_torn_line(test_client, test_journal_store):
+        """ Tests whether a change appended after a line left unfinished by a crash is kept. """
+        with open(test_journal_store.journal_path, mode="a", encoding="UTF-8") as f:
+            f.write('{"op": "vote", "story": {"id": 1')
+        test_client.patch("/stories/3", json={"title": "Kept after a crash"})
+        assert StoryStore(test_journal_store.path, journal=True).get(3)['title'] \
+            == "Kept after a crash"
+
+    @staticmethod
+    def test_journal_vote(test_client, test_journal_store, test_basic_story):
+        """ Tests whether a vote is appended to the journal instead of rewriting the file. """
+        response = test_client.post(
+            "/stories/1/votes", json={"direction": "up"})
+        assert response.status_code == 201
+        assert load_from_file(test_journal_store.path) == test_basic_story
+        records = load_from_journal(test_journal_store.journal_path)
+        assert len(records) == 1
+        assert records[0]['op'] == 'vote'
+        assert records[0]['story']['score'] == 43
+
+    @staticmethod
+    def test_journal_replay(test_client, test_journal_store, test_url, test_title):
+        """ Tests whether a new store rebuilds the stories by replaying the journal. """
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        test_client.delete("/stories/3")
+        test_client.post("/stories", json=test_url | test_title)
+
+        stories = StoryStore(test_journal_store.path).load()
+        assert [story['id'] for story in stories] == [1, 4, 5, 6]
+        assert stories[0]['score'] == 43
+        assert stories[-1]['title'] == test_title['title']
+
+    @staticmethod
+    def test_journal_unfinished_line(test_journal_store):
+        """ Tests whether a record cut short by a crash is ignored when replaying. """
+        with open(test_journal_store.journal_path, mode="w", encoding="UTF-8") as f:
+            f.write('{"op": "delete", "id": 1}\n{"op": "delete", "i')
+
+        stories = StoryStore(test_journal_store.path).load()
+        assert [story['id'] for story in stories] == [3, 4, 5]
+
+    @staticmethod
+    def test_journal_compact(test_client, test_journal_store):
+        """ Tests whether compacting folds the journal into the stories file. """
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        test_journal_store.compact()
+
+        assert load_from_file(test_journal_store.path)[0]['score'] == 43
+        assert load_from_journal(test_journal_store.journal_path) == []
+        assert test_journal_store.load()[0]['score'] == 43
+
+    @staticmethod
+    def test_journal_background_compact(test_client, test_journal_store):
+        """ Tests whether the journal is compacted once it passes the size threshold. """
+        test_journal_store.compact_bytes = 1
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        test_journal_store._compactor.join()
+
+        assert load_from_file(test_journal_store.path)[0]['score'] == 43
+        assert load_from_journal(test_journal_store.journal_path) == []
+
+    @staticmethod
+    def test_journal_leftover_compacting(test_client, test_journal_store):
+        """ Tests whether a compacting journal left by a crash is folded in by the
+            next compaction rather than stopping compaction for good. """
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        os.replace(test_journal_store.journal_path, test_journal_store.compacting_path)
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        test_journal_store.compact()
+
+        assert not os.path.exists(test_journal_store.compacting_path)
+        assert not os.path.exists(test_journal_store.journal_path)
+        assert load_from_file(test_journal_store.path)[0]['score'] == 44
+        assert StoryStore(test_journal_store.path, journal=True).load()[0]['score'] == 44
+
+    @staticmethod
+    def test_journal_compact_write_fails(test_client, test_journal_store):
+        """ Tests whether a compaction whose snapshot can't be written doesn't leave
+            its compacting journal behind. """
+        write_temp_file = storage.write_temp_file
+        calls = []
+
+        def write_once_failing(data, path):
+            calls.append(path)
+            if len(calls) == 1:
+                raise OSError("No space left on device")
+            return write_temp_file(data, path)
+
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        with patch('storage.write_temp_file', side_effect=write_once_failing):
+            with pytest.raises(OSError):
+                test_journal_store.compact()
+
+        assert not os.path.exists(test_journal_store.compacting_path)
+        assert load_from_file(test_journal_store.path)[0]['score'] == 43
+
+    @staticmethod
+    def test_next_id(test_store):
+        """ Tests whether new ids carry on from the highest id. """
+        assert test_store.next_id() == 6
+        assert test_store.next_id() == 7
+
+    @staticmethod
+    def test_next_id_not_reused(test_client, test_store, test_url, test_title):
+        """ Tests whether the id of a deleted story is not handed out again,
+            even by a store that is started afterwards. """
+        test_client.post("/stories", json=test_url | test_title)
+        test_client.delete("/stories/6")
+
+        assert StoryStore(test_store.path).next_id() == 7
+
+    @staticmethod
+    def test_next_id_not_reused_journal(test_client, test_journal_store, test_url, test_title):
+        """ Tests whether the id of a deleted story is not handed out again after compacting. """
+        test_client.post("/stories", json=test_url | test_title)
+        test_client.delete("/stories/6")
+        test_journal_store.compact()
+
+        assert StoryStore(test_journal_store.path).next_id() == 7
+
+    @staticmethod
+    def test_normalize_url():
+        """ Tests whether urls differing only by scheme, slash or tracking parameters match. """
+        assert (normalize_url("https://WWW.bbc.co.uk/news/?utm_medium=social&b=2&a=1#top")
+                == normalize_url("http://www.bbc.co.uk/news?a=1&b=2"))
+        assert normalize_url("https://www.bbc.co.uk/news?id=1") != normalize_url(
+            "https://www.bbc.co.uk/news?id=2")
+
+    @staticmethod
+    def test_has_url_after_update(test_client, test_store, test_url):
+        """ Tests whether the url index follows a story's url when it is changed. """
+        test_client.patch("/stories/1", json=test_url)
+        assert test_store.has_url(test_url['url'])
+        assert not test_store.has_url("https://www.vice.com/en/article/xgzxvz/"
+                                      "voters-overwhelmingly-back-community-broadband-in-chicago-and-denver")
+
+    @staticmethod
+    def test_parse_timestamp(test_basic_story):
+        """ Tests whether timestamps are parsed to the same time as strptime gives. """
+        for story in test_basic_story:
+            expected = datetime.strptime(story['created_at'], TIME_FORMAT)
+            assert parse_timestamp(story['created_at']) == calendar.timegm(expected.timetuple())
+
+    @staticmethod
+    def test_save_failure_keeps_file(test_store, test_basic_story):
+        """ Tests whether a write that fails part way leaves the old file in place. """
+        with patch('storage.os.fsync', side_effect=OSError("Disk full")):
+            try:
+                save_to_file([], test_store.path)
+            except OSError:
+                pass
+        assert load_from_file(test_store.path) == test_basic_story
+        assert not [name for name in os.listdir(os.path.dirname(test_store.path))
+                    if name.endswith(".tmp")]
+
+    @staticmethod
+    def test_reads_not_blocked_by_writer(test_store):
+        """ Tests whether stories can still be read while a writer waits for another
+            process's lock and while a write is being flushed to disk. """
+        if not storage.fcntl:
+            pytest.skip("File locks are not supported")
+        other_process = open(test_store.lock_path, mode="a", encoding="UTF-8")
+        storage.fcntl.flock(other_process, storage.fcntl.LOCK_EX)
+        writer = Thread(target=lambda: test_store.commit("vote", test_store.get(1)), daemon=True)
+        reader = Thread(target=lambda: (test_store.load(), test_store.version()), daemon=True)
+        try:
+            writer.start()
+            reader.start()
+            reader.join(timeout=2)
+            assert not reader.is_alive()
+        finally:
+            storage.fcntl.flock(other_process, storage.fcntl.LOCK_UN)
+            other_process.close()
+        writer.join(timeout=2)
+        assert not writer.is_alive()
+
+    @staticmethod
+    def test_concurrent_votes(test_store):
+        """ Tests whether votes made through separate stores on the same file are all kept. """
+        def vote_many(store):
+            for _ in range(25):
+                with store.transaction():
+                    story = store.get(1)
+                    story['score'] += 1
+                    store.commit("vote", story)
+
+        threads = [Thread(target=vote_many, args=(StoryStore(test_store.path),))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert load_from_file(test_store.path)[0]['score'] == 92
+
+    @staticmethod
+    def test_buffered_votes(test_client, test_store, test_basic_story, monkeypatch):
+        """ Tests whether buffered votes show straight away but are written in one batch. """
+        monkeypatch.setattr(test_store, "vote_flush_ms", 60000)
+        monkeypatch.setattr(test_store, "vote_flush_count", 4)
+        test_client.post("/stories/3/votes", json={"direction": "up"})
+        test_client.post("/stories/3/votes", json={"direction": "down"})
+        response = test_client.post("/stories/3/votes", json={"direction": "down"})
+        assert response.status_code == 400
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        assert test_store.get(1)['score'] == 43
+        assert load_from_file(test_store.path) == test_basic_story
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        assert load_from_file(test_store.path)[0]['score'] == 44
+
+    @staticmethod
+    def test_buffered_votes_survive_reload(test_store, test_basic_story):
+        """ Tests whether buffered votes are kept when another writer changes the file,
+            and are written by flush. """
+        store = StoryStore(test_store.path, vote_flush_ms=60000)
+        with store.transaction():
+            story = store.get(1)
+            story['score'] += 2
+            store.commit("vote", story)
+        changed_stories = copy.deepcopy(test_basic_story)
+        changed_stories[0]['score'] = 50
+        save_to_file(changed_stories, test_store.path)
+        assert store.get(1)['score'] == 52
+        store.flush()
+        assert load_from_file(test_store.path)[0]['score'] == 52
+
+
+class TestBackends():
+
+    """ Class for Testing that every kind of store behaves the same through the API. """
+
+    @staticmethod
+    def test_get(test_client, test_backend, test_basic_story):
+        """ Tests whether the stories are returned as they were saved. """
+        assert test_client.get("/stories").json == test_basic_story
+        assert test_backend.get(4) == test_basic_story[2]
+        assert test_backend.get(6) is None
+        assert test_backend.count() == 4
+
+    @staticmethod
+    def test_first_write_changes_version(test_client, test_empty_backend, test_url, test_title):
+        """ Tests whether the first story added to an empty store changes the version,
+            so a listing cached while it was empty isn't sent again. """
+        etag = test_client.get("/stories").headers['ETag']
+        version = test_empty_backend.version()[0]
+        test_client.post("/stories", json=test_url | test_title)
+        assert test_empty_backend.version()[0] != version
+        response = test_client.get("/stories", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert len(response.json) == 1
+
+    @staticmethod
+    def test_concurrent_creates_deduplicated(test_backend, test_url):
+        """ Tests whether two workers adding the same url at once add only one story. """
+        barrier = Barrier(2, timeout=5)
+        added = []
+
+        def add():
+            barrier.wait()
+            with test_backend.transaction():
+                if not test_backend.has_url(test_url['url']):
+                    # Gives the other worker time to check the url before this one commits.
+                    time.sleep(0.2)
+                    story = HelpApp.create_story(test_backend.next_id(), test_url['url'], "Same")
+                    test_backend.commit("create", story)
+                    added.append(story)
+
+        threads = [Thread(target=add) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        assert len(added) == 1
+        assert test_backend.count() == 5
+
+    @staticmethod
+    def test_vote(test_client, test_backend):
+        """ Tests whether votes change the score and the zero score rule still holds. """
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        test_client.post("/stories/1/votes", json={"direction": "down"})
+        response = test_client.post("/stories/3/votes", json={"direction": "down"})
+        assert response.status_code == 400
+        assert test_backend.get(1)['score'] == 43
+        assert test_backend.get(3)['score'] == 0
+
+    @staticmethod
+    @pytest.mark.parametrize("order", ["ascending", "descending"])
+    def test_search_ties_ordered_by_id(test_client, test_backend, order):
+        """ Tests whether stories with the same score come in the same order
+            whether or not they are searched for. """
+        test_client.post("/stories/batch", json=[
+            {"url": f"https://www.bbc.co.uk/news/same-{n}", "title": f"Same story {n}"}
+            for n in range(5)])
+        listed = test_client.get(f"/stories?sort=score&order={order}").json
+        searched = test_client.get(f"/stories?sort=score&order={order}&search=same").json
+        same_ids = [story['id'] for story in listed if story['title'].startswith("Same")]
+        assert [story['id'] for story in searched] == same_ids
+        assert same_ids == sorted(same_ids, reverse=order == "descending")
+
+    @staticmethod
+    def test_sort_and_page(test_client, test_backend, test_created_at_ascending_stories):
+        """ Tests whether sorting and paging give the same stories on every store. """
+        response = test_client.get("/stories?sort=created&order=descending&limit=2&offset=1")
+        assert response.json['stories'] == test_created_at_ascending_stories[::-1][1:3]
+        assert response.json['next_offset'] == 3
+        assert response.json['total'] == 4
+
+    @staticmethod
+    def test_search(test_client, test_backend):
+        """ Tests whether searching ignores case and finds part of a word. """
+        response = test_client.get("/stories?search=VACC&limit=5")
+        assert [story['id'] for story in response.json['stories']] == [4]
+        response = test_client.get("/stories?search=in&sort=score&order=ascending")
+        assert [story['id'] for story in response.json] == [3, 1, 4]
+        response = test_client.get("/stories?search=100%&sort=score")
+        assert response.status_code == 404
+
+    @staticmethod
+    def test_create_update_delete(test_client, test_backend, test_url, test_title):
+        """ Tests whether stories can be added, changed and deleted, without reusing ids. """
+        assert test_client.post("/stories", json=test_url | test_title).status_code == 201
+        assert test_client.post("/stories", json=test_url | test_title).status_code == 409
+        test_client.patch("/stories/6", json={"title": "Shoplifting on the rise"})
+        assert test_backend.get(6)['title'] == "Shoplifting on the rise"
+        test_client.delete("/stories/6")
+        assert test_backend.get(6) is None
+        assert not test_backend.has_url(test_url['url'])
+        assert test_backend.next_id() == 7
+
+    @staticmethod
+    def test_batch_votes(test_client, test_backend):
+        """ Tests whether several votes on one story in a batch are all counted. """
+        test_client.post("/stories/batch/votes", json=[{"id": 1, "direction": "up"}] * 3
+                         + [{"id": 1, "direction": "down"}])
+        assert test_backend.get(1)['score'] == 44
+
+    @staticmethod
+    def test_version(test_client, test_backend, test_url, test_title):
+        """ Tests whether the list's ETag changes with every kind of change. """
+        etags = [test_client.get("/stories").headers['ETag']]
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        etags.append(test_client.get("/stories").headers['ETag'])
+        test_client.post("/stories", json=test_url | test_title)
+        etags.append(test_client.get("/stories").headers['ETag'])
+        test_client.delete("/stories/6")
+        etags.append(test_client.get("/stories").headers['ETag'])
+        assert len(set(etags)) == 4
+        response = test_client.get("/stories", headers={"If-None-Match": etags[-1]})
+        assert response.status_code == 304
+
+    @staticmethod
+    def test_page_past_the_end(test_client, test_backend):
+        """ Tests whether the largest offset allowed gives an empty page rather than
+            an error from the database. """
+        response = test_client.get(f"/stories?limit=5&offset={api.MAX_OFFSET}")
+        assert response.status_code == 200
+        assert response.json == {"stories": [], "next_offset": None, "total": 4}
+        assert test_client.get(f"/stories?limit=5&offset={api.MAX_OFFSET + 1}").status_code == 400
+
+    @staticmethod
+    def test_changes(test_client, test_backend):
+        """ Tests whether only the stories changed since the given time are returned,
+            with tombstones for deleted stories, and whether a later since leaves them out. """
+        since = test_client.get("/stories/changes?since=" + timestamp_now()).json['since']
+        assert test_client.get("/stories/changes", query_string={"since": since}).json == {
+            "stories": [], "deleted": [], "since": since}
+        test_client.post("/stories/1/votes", json={"direction": "up"})
+        test_client.delete("/stories/3")
+        response = test_client.get("/stories/changes", query_string={"since": since})
+        assert response.status_code == 200
+        assert response.json['stories'] == [test_backend.get(1)]
+        assert [tombstone['id'] for tombstone in response.json['deleted']] == [3]
+        assert parse_timestamp(response.json['deleted'][0]['deleted_at']) >= parse_timestamp(since)
+
+    @staticmethod
+    def test_changes_invalid_since(test_client, test_backend):
+        """ Tests whether a missing, malformed or future since is rejected,
+            and one older than the tombstones are kept for is gone. """
+        later = parse_timestamp(timestamp_now()) + 60
+        for since in ["", "yesterday", "²", "99999999999999999", str(later),
+                      "Sun, 20 Mar 99999 08:43:21 GMT"]:
+            response = test_client.get("/stories/changes", query_string={"since": since})
+            assert response.status_code == 400
+        assert test_client.get("/stories/changes").status_code == 400
+        response = test_client.get("/stories/changes",
+                                   query_string={"since": "Sun, 20 Mar 2022 08:43:21 GMT"})
+        assert response.status_code == 410
+
+
+class TestSQLiteStore():
+
+    """ Class for Testing the SQLiteStore class. """
+
+    @staticmethod
+    def test_migrate_from_json(tmp_path, test_basic_story):
+        """ Tests whether stories.json is copied into the database with its id counter. """
+        json_store = StoryStore(str(tmp_path / "stories.json"))
+        json_store.save(copy.deepcopy(test_basic_story))
+        db_path = str(tmp_path / "stories.db")
+        assert migrate_from_json(json_store.path, db_path) == 4
+        store = SQLiteStore(db_path)
+        assert store.load() == test_basic_story
+        assert store.next_id() == 6
+        store.close()
+        with closing(sqlite3.connect(db_path)) as connection:
+            assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    @staticmethod
+    def test_search_follows_title_changes(tmp_path, test_basic_story):
+        """ Tests whether the title search index is kept in step with updates and deletes. """
+        store = SQLiteStore(str(tmp_path / "stories.db"))
+        store.save(copy.deepcopy(test_basic_story))
+        story = store.get(4) | {"title": "Shoplifting on the rise"}
+        store.commit('update', story)
+        assert store.search("vaccine") == ([], 0)
+        assert store.search("LIFT") == ([story], 1)
+        store.commit('delete', story)
+        assert store.search("lift") == ([], 0)
+        store.close()
+
+    @staticmethod
+    def test_vote_below_zero_rejected(tmp_path, test_basic_story):
+        """ Tests whether a downvote whose score changed after it was read, so that it
+            would go below 0, raises rather than being reported as saved. """
+        store = SQLiteStore(str(tmp_path / "stories.db"))
+        store.save(copy.deepcopy(test_basic_story))
+        with pytest.raises(ScoreBelowZero):
+            with store.transaction():
+                story = store.get(1)
+                store._connection().execute(  # pylint: disable=protected-access
+                    "UPDATE stories SET score = 0 WHERE id = 1")
+                HelpApp.vote_story(story, 'down')
+                store.commit('vote', story)
+        assert store.get(1)['score'] == 42
+        store.close()
+
+    @staticmethod
+    def test_thread_connections_closed(tmp_path):
+        """ Tests whether each thread's connection is closed once the thread ends,
+            so a thread per request doesn't leave a connection open per request. """
+        store = SQLiteStore(str(tmp_path / "stories.db"))
+        for _ in range(3):
+            threads = [Thread(target=store.count) for _ in range(50)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            del threads, thread
+            gc.collect()
+            assert len(store._connections) == 1  # pylint: disable=protected-access
+        assert store.count() == 0
+        store.close()
+
+
+class TestSortedIndex():
+
+    """ Class for Testing the SortedIndex class. """
+
+    @staticmethod
+    def test_build():
+        """ Tests whether the ids are listed in key order, with ties in id order. """
+        index = SortedIndex()
+        index.build({3: 10, 1: 30, 2: 10})
+        assert index.ids() == [2, 3, 1]
+        assert index.ids(reverse=True) == [1, 3, 2]
+
+    @staticmethod
+    def test_add_moves_changed_key():
+        """ Tests whether adding a story again moves it to the place for its new key. """
+        index = SortedIndex()
+        index.build({1: 5, 2: 10})
+        index.add(1, 20)
+        index.add(3, 0)
+        assert index.ids() == [3, 2, 1]
+        assert len(index) == 3
+
+    @staticmethod
+    def test_remove():
+        """ Tests whether a removed story is no longer listed and unknown ids are ignored. """
+        index = SortedIndex()
+        index.build({1: 5, 2: 10})
+        index.remove(1)
+        index.remove(7)
+        assert index.ids() == [2]
+
+    @staticmethod
+    def test_ids_slice():
+        """ Tests whether a range of positions can be read in either direction. """
+        index = SortedIndex()
+        index.build({s_id: s_id for s_id in range(10)})
+        assert index.ids(start=2, stop=5) == [2, 3, 4]
+        assert index.ids(reverse=True, start=2, stop=5) == [7, 6, 5]
+        assert index.ids(reverse=True, start=8, stop=20) == [1, 0]
+
+
+class TestSearchIndex():
+
+    """ Class for Testing the SearchIndex class. """
+
+    @staticmethod
+    def test_search_matches_substring_scan(test_basic_story):
+        """ Tests whether the index finds the same stories as checking every title. """
+        index = SearchIndex()
+        for story in test_basic_story:
+            index.add(story['id'], story['title'])
+        for term in ["BOOST", "vacc", "ine", "in", "e", "an assassin", "nothing here", "s, c"]:
+            expected = [story['id'] for story in test_basic_story
+                        if term.lower() in story['title'].lower()]
+            assert index.search(term) == expected
+
+    @staticmethod
+    def test_search_after_change():
+        """ Tests whether a changed or removed title is searched by its current words only. """
+        index = SearchIndex()
+        index.add(1, "Budget boost for pensions")
+        index.add(2, "Pensions to rise")
+        index.add(1, "Election results")
+        index.remove(2)
+        assert index.search("pension") == []
+        assert index.search("election") == [1]
+
+
 class TestHelpApp():
 
     """ Class for Testing the HelpApp class. """
@@ -404,70 +1564,61 @@ class TestHelpApp():
             "%a, %d %b %Y %H:%M:%S GMT")
 
     @staticmethod
-    def test_search_story(test_basic_story):
+    def test_search_story(test_store):
         """ Tests whether the stories are filtered correctly by search terms. """
-        queried_stories = HelpApp.search_stories(
-            copy.deepcopy(test_basic_story), "coronavirus")
+        queried_stories, status, total = HelpApp.search_sort(test_store, "coronavirus", None, None)
+        assert (status, total) == (200, 1)
         assert len(queried_stories) == 1
         assert "coronavirus" in queried_stories[0]['title']
 
     @staticmethod
-    def test_sort_title_descending(test_basic_story, test_title_ascending_stories):
+    def test_sort_title_descending(test_store, test_title_ascending_stories):
         """ Tests whether the stories are sorted by title in descending order. """
-        sorted_stories = HelpApp.sort_stories(copy.deepcopy(test_basic_story),
-                                              "title", "descending")
+        sorted_stories = HelpApp.search_sort(test_store, None, "title", "descending")[0]
         assert sorted_stories == test_title_ascending_stories[::-1]
 
     @staticmethod
-    def test_sort_title_ascending(test_basic_story, test_title_ascending_stories):
+    def test_sort_title_ascending(test_store, test_title_ascending_stories):
         """ Tests whether the stories are sorted by title in ascending order. """
-        sorted_stories = HelpApp.sort_stories(copy.deepcopy(test_basic_story),
-                                              "title", "ascending")
+        sorted_stories = HelpApp.search_sort(test_store, None, "title", "ascending")[0]
         assert sorted_stories == test_title_ascending_stories
 
     @staticmethod
-    def test_sort_score_descending(test_basic_story, test_score_ascending_stories):
+    def test_sort_score_descending(test_store, test_score_ascending_stories):
         """ Tests whether the stories are sorted by score in descending order. """
-        sorted_stories = HelpApp.sort_stories(copy.deepcopy(test_basic_story),
-                                              "score", "descending")
+        sorted_stories = HelpApp.search_sort(test_store, None, "score", "descending")[0]
         assert sorted_stories == test_score_ascending_stories[::-1]
 
     @staticmethod
-    def test_sort_score_ascending(test_basic_story, test_score_ascending_stories):
+    def test_sort_score_ascending(test_store, test_score_ascending_stories):
         """ Tests whether the stories are sorted by score in ascending order. """
-        sorted_stories = HelpApp.sort_stories(copy.deepcopy(test_basic_story),
-                                              "score", "ascending")
+        sorted_stories = HelpApp.search_sort(test_store, None, "score", "ascending")[0]
         assert sorted_stories == test_score_ascending_stories
 
     @staticmethod
-    def test_sort_created_at_descending(test_basic_story, test_created_at_ascending_stories):
+    def test_sort_created_at_descending(test_store, test_created_at_ascending_stories):
         """ Tests whether the stories are sorted by created date in descending order. """
-        sorted_stories = HelpApp.sort_stories(copy.deepcopy(test_basic_story),
-                                              "created", "descending")
+        sorted_stories = HelpApp.search_sort(test_store, None, "created", "descending")[0]
         assert sorted_stories == test_created_at_ascending_stories[::-1]
 
     @staticmethod
-    def test_sort_created_at_ascending(test_basic_story, test_created_at_ascending_stories):
+    def test_sort_created_at_ascending(test_store, test_created_at_ascending_stories):
         """ Tests whether the stories are sorted by created date in ascending order. """
-        sorted_stories = HelpApp.sort_stories(copy.deepcopy(test_basic_story),
-                                              "created", "ascending")
+        sorted_stories = HelpApp.search_sort(test_store, None, "created", "ascending")[0]
         assert sorted_stories == test_created_at_ascending_stories
 
     @staticmethod
-    def test_sort_updated_at_descending(test_basic_story, test_updated_at_ascending_stories):
+    def test_sort_updated_at_descending(test_store, test_updated_at_ascending_stories):
         """ Tests whether the stories are sorted by updated date in descending order. """
-        sorted_stories = HelpApp.sort_stories(copy.deepcopy(test_basic_story),
-                                              "modified", "descending")
+        sorted_stories = HelpApp.search_sort(test_store, None, "modified", "descending")[0]
         assert sorted_stories == test_updated_at_ascending_stories[::-1]
 
     @staticmethod
-    def test_sort_updated_at_ascending(test_basic_story, test_updated_at_ascending_stories):
+    def test_sort_updated_at_ascending(test_store, test_updated_at_ascending_stories):
         """ Tests whether the stories are sorted by updated date in ascending order. """
-        sorted_stories = HelpApp.sort_stories(copy.deepcopy(test_basic_story),
-                                              "modified", "ascending")
+        sorted_stories = HelpApp.search_sort(test_store, None, "modified", "ascending")[0]
         assert sorted_stories == test_updated_at_ascending_stories
 
-
     @staticmethod
     def test_update_story_url(test_basic_story, test_url):
         """ Tests whether the story's url is updated alongside the 
@@ -504,7 +1655,7 @@ class TestHelpApp():
     @staticmethod
     def test_create_story(test_basic_story, test_url, test_title):
         """ Tests whether a new story is created properly. """
-        story = HelpApp.create_story(test_basic_story, test_url['url'], test_title['title'])
+        story = HelpApp.create_story(6, test_url['url'], test_title['title'])
         assert story['created_at'] == datetime.now().strftime(
             "%a, %d %b %Y %H:%M:%S GMT")
         assert story['updated_at'] == datetime.now().strftime(